@@ -0,0 +1,288 @@
+"""
+Closure-compilation engine for the v4 Brewin interpreter.
+
+Each AST node is turned once into a Python closure with its operands, variable names and
+handlers already bound, so running a node is a single call. Scoping, calls, objects and
+operators go through the Interpreter's runtime methods, same as the tree walker.
+"""
+
+from intbase import InterpreterBase, ErrorType
+from cell import Cell
+from completion import Return
+
+
+class ClosureEngine:
+    def __init__(self, interpreter_instance):
+        self.inter_instance = interpreter_instance
+        self.block_code = {}  # id(statement list) -> compiled block
+        self.expression_code = {}  # id(expression node) -> compiled expression
+
+    # replace the interpreter's block and expression runners with compiled ones
+    def install(self, ast):
+        for func in ast.get("functions"):
+            self.get_block(func.get("statements"))
+        self.inter_instance.run_block = self.run_block
+        self.inter_instance.evaluate_expression = self.evaluate_expression
+
+    def get_block(self, statements):
+        block = self.block_code.get(id(statements))
+        if block is None:
+            block = self.compile_block(statements)
+            self.block_code[id(statements)] = block
+        return block
+
+    def run_block(self, statements):
+        return self.get_block(statements)()
+
+    def evaluate_expression(self, expression_node):
+        expression = self.expression_code.get(id(expression_node))
+        if expression is None:
+            expression = self.compile_expression(expression_node)
+            self.expression_code[id(expression_node)] = expression
+        return expression()
+
+    # compiled blocks return the Return record if returning, None otherwise
+    def compile_block(self, statements):
+        compiled = []
+        for statement in statements:
+            compiled_statement = self.compile_statement(statement)
+            if compiled_statement is not None:
+                compiled.append(compiled_statement)
+        compiled = tuple(compiled)
+
+        def run_block():
+            for statement in compiled:
+                completion = statement()
+                if completion is not None:
+                    return completion
+            return None
+
+        return run_block
+
+    # runs a nested if block with its own scope; new_vars comes from BlockVarAnalyzer
+    def compile_scoped_block(self, statements, new_vars):
+        block = self.compile_block(statements)
+        get_new_block_vars = self.inter_instance.get_new_block_vars
+        clean_block_scope = self.inter_instance.clean_block_scope
+
+        #blocks that never create variables don't need a scope
+        if not new_vars:
+            return block
+
+        def run_scoped_block():
+            local_vars = get_new_block_vars(new_vars)
+            completion = block()
+            clean_block_scope(local_vars)
+            return completion
+
+        return run_scoped_block
+
+    # compiled statements take no arguments and return the Return record if returning, None otherwise
+    def compile_statement(self, statement):
+        kind = statement.elem_type
+        if kind == "=":
+            return self.compile_assignment(statement)
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            call = self.compile_expression(statement)
+
+            def run_call():
+                call()
+
+            return run_call
+        if kind == InterpreterBase.IF_DEF:
+            return self.compile_if(statement)
+        if kind == InterpreterBase.WHILE_DEF:
+            return self.compile_while(statement)
+        if kind == InterpreterBase.RETURN_DEF:
+            return self.compile_return(statement)
+        # any other expression used as a statement is never evaluated, same as run_statement
+        return None
+
+    def compile_assignment(self, statement):
+        inter_instance = self.inter_instance
+        variable_slots = inter_instance.variable_slots
+        var_slot = statement.slot
+        expression = self.compile_expression(statement.get("expression"))
+
+        if statement.field_name is not None:
+            get_object = inter_instance.get_object
+            object_name = statement.object_name
+            object_slot = statement.object_slot
+            field_name = statement.field_name
+            cell = statement.cell
+
+            def assign_field():
+                value = expression()
+                get_object(object_name, object_slot, cell).assign_field(field_name, value, inter_instance)
+
+            return assign_field
+
+        #'this' and closure vars of lambdas that use cells
+        if var_slot is None or statement.cell:
+            do_assignment = inter_instance.do_assignment
+
+            def assign_slow():
+                do_assignment(statement, expression())
+
+            return assign_slow
+
+        def assign():
+            value = expression()
+            var_stack = variable_slots[var_slot]
+            if var_stack:
+                top = var_stack[-1]
+                #if variable is a reference, assign to the referenced variable
+                if type(top) is Cell:
+                    top.value = value
+                else:
+                    var_stack[-1] = value
+            else:
+                var_stack.append(value)
+
+        return assign
+
+    def compile_if(self, if_node):
+        error = self.inter_instance.error
+        condition = self.compile_expression(if_node.get("condition"))
+        true_block = self.compile_scoped_block(if_node.get("statements"), if_node.new_vars)
+        else_statements = if_node.get("else_statements")
+        false_block = None
+        if else_statements is not None:
+            false_block = self.compile_scoped_block(else_statements, if_node.else_new_vars)
+
+        def run_if():
+            result = condition()
+            if not isinstance(result, int):
+                error(ErrorType.TYPE_ERROR, "condition does not evaluate to boolean")
+            if result:
+                return true_block()
+            if false_block is not None:
+                return false_block()
+            return None
+
+        return run_if
+
+    # the condition is evaluated and type checked once per iteration
+    def compile_while(self, while_node):
+        error = self.inter_instance.error
+        get_new_block_vars = self.inter_instance.get_new_block_vars
+        clean_block_scope = self.inter_instance.clean_block_scope
+        new_vars = while_node.new_vars
+        condition = self.compile_expression(while_node.get("condition"))
+        block = self.compile_block(while_node.get("statements"))
+
+        def run_while():
+            block_vars = get_new_block_vars(new_vars)
+            while True:
+                result = condition()
+                if not isinstance(result, int):
+                    error(ErrorType.TYPE_ERROR, "condition does not evaluate to boolean")
+                if not result:
+                    break
+                completion = block()
+                if completion is not None:
+                    clean_block_scope(block_vars)
+                    return completion
+            clean_block_scope(block_vars)
+            return None
+
+        return run_while
+
+    def compile_return(self, return_node):
+        inter_instance = self.inter_instance
+        expression_node = return_node.get("expression")
+
+        if expression_node is None:
+            def return_nil():
+                return Return(None)
+
+            return return_nil
+
+        if return_node.tail_call:
+            evaluate_tail_call = inter_instance.evaluate_tail_call
+            expression = lambda: evaluate_tail_call(return_node)
+        else:
+            expression = self.compile_expression(expression_node)
+        copy_return_value = inter_instance.copy_return_value
+
+        def return_value():
+            return Return(copy_return_value(expression()))
+
+        return return_value
+
+    # compiled expressions take no arguments and return the expression's value
+    def compile_expression(self, expression_node):
+        inter_instance = self.inter_instance
+        variable_slots = inter_instance.variable_slots
+        kind = expression_node.elem_type
+
+        if kind == InterpreterBase.VAR_DEF:
+            var_slot = expression_node.slot
+            evaluate_variable = inter_instance.evaluate_variable
+            if expression_node.field_name is not None:
+                get_object = inter_instance.get_object
+                object_name = expression_node.object_name
+                object_slot = expression_node.object_slot
+                field_name = expression_node.field_name
+                cell = expression_node.cell
+                return lambda: get_object(object_name, object_slot, cell).get_field(field_name)
+
+            #'this' and closure vars of lambdas that use cells
+            if var_slot is None or expression_node.cell:
+                return lambda: evaluate_variable(expression_node)
+
+            def load():
+                var_stack = variable_slots[var_slot]
+                if var_stack:
+                    value = var_stack[-1]
+                    #if variable is a reference, look up the referenced value
+                    if type(value) is Cell:
+                        return value.value
+                    return value
+                #function name, or an undefined variable error
+                return evaluate_variable(expression_node)
+
+            return load
+
+        if (kind == InterpreterBase.INT_DEF or kind == InterpreterBase.STRING_DEF or
+                kind == InterpreterBase.BOOL_DEF or kind == InterpreterBase.NIL_DEF):
+            value = expression_node.get("val")
+            return lambda: value
+
+        if kind == InterpreterBase.FCALL_DEF:
+            do_func_call = inter_instance.do_func_call
+            return lambda: do_func_call(expression_node)
+
+        if kind == InterpreterBase.MCALL_DEF:
+            evaluate_method_call = inter_instance.evaluate_method_call
+            return lambda: evaluate_method_call(expression_node)
+
+        if kind == InterpreterBase.NEG_DEF or kind == InterpreterBase.NOT_DEF:
+            apply_unary_operator = inter_instance.apply_unary_operator
+            op1 = self.compile_expression(expression_node.get("op1"))
+            return lambda: apply_unary_operator(kind, op1())
+
+        if kind == InterpreterBase.LAMBDA_DEF:
+            evaluate_lambda = inter_instance.evaluate_lambda
+            return lambda: evaluate_lambda(expression_node)
+
+        if kind == InterpreterBase.OBJ_DEF:
+            return inter_instance.create_object
+
+        apply_binary_operator = inter_instance.apply_binary_operator
+        op1 = self.compile_expression(expression_node.get("op1"))
+        op2 = self.compile_expression(expression_node.get("op2"))
+
+        if (kind == "&&" or kind == "||") and inter_instance.short_circuit:
+            short_circuits = inter_instance.short_circuits
+            result = kind == "||"
+
+            def run_short_circuit():
+                op1_value = op1()
+                if short_circuits(kind, op1_value):
+                    return result
+                return apply_binary_operator(kind, op1_value, op2())
+
+            return run_short_circuit
+
+        return lambda: apply_binary_operator(kind, op1(), op2())
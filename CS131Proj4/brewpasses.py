@@ -0,0 +1,513 @@
+"""
+Passes over the AST from brewparse.parse_program, run once before the program is evaluated.
+"""
+
+from intbase import InterpreterBase
+
+
+class SlotResolver:
+    """
+    Gives every variable name in the program a slot index into the interpreter's list of
+    variable stacks. Brewin is dynamically scoped, so a name refers to the same stack of
+    bindings wherever it appears and one slot per name is enough.
+
+    Annotates nodes with:
+      var and '=' nodes: slot (plain variable) or object_slot (object of a dotted name), and
+        object_name and field_name (the two halves of a dotted name, None otherwise)
+      arg and refarg nodes: slot
+      fcall nodes: slot (for calling a function stored in a variable), and call_target set to
+        None for the interpreter to cache what the call resolves to
+      mcall nodes: object_slot, and method_cache set to None for the interpreter to cache
+        where the method was found
+    'this' never gets a slot; nodes that refer to it have slot/object_slot set to None.
+    """
+
+    def __init__(self):
+        self.slots = {}  # variable name -> slot index
+
+    def slot_for(self, var_name):
+        slot = self.slots.get(var_name)
+        if slot is None:
+            slot = len(self.slots)
+            self.slots[var_name] = slot
+        return slot
+
+    def resolve_program(self, ast):
+        for func in ast.get("functions"):
+            self.resolve_function(func)
+        return len(self.slots)
+
+    # function and lambda nodes
+    def resolve_function(self, func_node):
+        for arg in func_node.get("args"):
+            arg.slot = self.slot_for(arg.get("name"))
+        self.resolve_statements(func_node.get("statements"))
+
+    def resolve_statements(self, statements):
+        for statement in statements:
+            self.resolve_statement(statement)
+
+    def resolve_statement(self, statement):
+        kind = statement.elem_type
+        if kind == "=":
+            self.resolve_target(statement)
+            self.resolve_expression(statement.get("expression"))
+        elif kind == InterpreterBase.IF_DEF:
+            self.resolve_expression(statement.get("condition"))
+            self.resolve_statements(statement.get("statements"))
+            if statement.get("else_statements") is not None:
+                self.resolve_statements(statement.get("else_statements"))
+        elif kind == InterpreterBase.WHILE_DEF:
+            self.resolve_expression(statement.get("condition"))
+            self.resolve_statements(statement.get("statements"))
+        elif kind == InterpreterBase.RETURN_DEF:
+            if statement.get("expression") is not None:
+                self.resolve_expression(statement.get("expression"))
+        else:
+            self.resolve_expression(statement)
+
+    # var and '=' nodes name either a plain variable or an object field ("obj.field")
+    def resolve_target(self, node):
+        var_name = node.get("name")
+        node.slot = None
+        node.object_slot = None
+        node.object_name = None
+        node.field_name = None
+        if "." in var_name:
+            object_name = var_name[0:var_name.index(".")]
+            node.object_name = object_name
+            node.field_name = var_name[var_name.index(".") + 1:]
+            if object_name != InterpreterBase.THIS_DEF:
+                node.object_slot = self.slot_for(object_name)
+        elif var_name != InterpreterBase.THIS_DEF:
+            node.slot = self.slot_for(var_name)
+
+    def resolve_expression(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_DEF:
+            self.resolve_target(node)
+        elif kind == InterpreterBase.FCALL_DEF:
+            node.slot = self.slot_for(node.get("name"))
+            node.call_target = None
+            for arg in node.get("args"):
+                self.resolve_expression(arg)
+        elif kind == InterpreterBase.MCALL_DEF:
+            object_name = node.get("objref")
+            node.object_slot = None
+            node.method_cache = None
+            if object_name != InterpreterBase.THIS_DEF:
+                node.object_slot = self.slot_for(object_name)
+            for arg in node.get("args"):
+                self.resolve_expression(arg)
+        elif kind == InterpreterBase.LAMBDA_DEF:
+            self.resolve_function(node)
+        else:
+            #unary and binary operators; values have no operands
+            if node.get("op1") is not None:
+                self.resolve_expression(node.get("op1"))
+            if node.get("op2") is not None:
+                self.resolve_expression(node.get("op2"))
+
+
+class BlockVarAnalyzer:
+    """
+    Records on each block the slots of the variables it might introduce, so the interpreter
+    doesn't have to track new variables assignment by assignment. Run after SlotResolver.
+
+    Annotates nodes with:
+      func and lambda nodes: param_slots (each parameter slot once), binding_plan ((slot,
+        passed by ref) for each parameter, in order) and new_vars
+      if nodes: new_vars (if block) and else_new_vars (else block)
+      while nodes: new_vars
+    new_vars holds the slots assigned directly in the block (not in nested blocks). Only the
+    ones that aren't in scope yet when the block starts are actually created by the block.
+    """
+
+    def analyze_program(self, ast):
+        for func in ast.get("functions"):
+            self.analyze_function(func)
+
+    # function and lambda nodes
+    def analyze_function(self, func_node):
+        param_slots = []
+        for arg in func_node.get("args"):
+            if arg.slot not in param_slots:
+                param_slots.append(arg.slot)
+        func_node.param_slots = tuple(param_slots)
+        func_node.binding_plan = tuple((arg.slot, arg.elem_type == InterpreterBase.REFARG_DEF)
+                                       for arg in func_node.get("args"))
+        func_node.new_vars = self.analyze_statements(func_node.get("statements"))
+
+    # returns slots assigned directly in statements, in order of first assignment
+    def analyze_statements(self, statements):
+        new_vars = []
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == "=":
+                #fields and 'this' have no slot
+                if statement.slot is not None and statement.slot not in new_vars:
+                    new_vars.append(statement.slot)
+                self.analyze_expression(statement.get("expression"))
+            elif kind == InterpreterBase.IF_DEF:
+                self.analyze_expression(statement.get("condition"))
+                statement.new_vars = self.analyze_statements(statement.get("statements"))
+                statement.else_new_vars = ()
+                if statement.get("else_statements") is not None:
+                    statement.else_new_vars = self.analyze_statements(statement.get("else_statements"))
+            elif kind == InterpreterBase.WHILE_DEF:
+                self.analyze_expression(statement.get("condition"))
+                statement.new_vars = self.analyze_statements(statement.get("statements"))
+            elif kind == InterpreterBase.RETURN_DEF:
+                if statement.get("expression") is not None:
+                    self.analyze_expression(statement.get("expression"))
+            else:
+                self.analyze_expression(statement)
+        return tuple(new_vars)
+
+    # only lambdas inside expressions have blocks of their own
+    def analyze_expression(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.LAMBDA_DEF:
+            self.analyze_function(node)
+        elif kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            for arg in node.get("args"):
+                self.analyze_expression(arg)
+        else:
+            if node.get("op1") is not None:
+                self.analyze_expression(node.get("op1"))
+            if node.get("op2") is not None:
+                self.analyze_expression(node.get("op2"))
+
+
+class ConstantFolder:
+    """
+    Replaces operator subexpressions whose operands are all literals with the literal they
+    evaluate to, so they aren't recomputed every time they run. Values are computed with the
+    interpreter's own operator code. A subexpression that fails (a TYPE_ERROR, or a Python
+    error like division by zero) is left as is so the error still happens when it runs.
+    String repetition (int * string) isn't folded either, since its result can be far bigger
+    than the program and the code may never run. Neither are the prompts of inputi and inputs,
+    which are printed as the node's literal value without being evaluated.
+
+    Folded nodes are rewritten in place into int, string, bool or nil nodes.
+    """
+
+    LITERAL_TYPES = {int: InterpreterBase.INT_DEF, bool: InterpreterBase.BOOL_DEF,
+                     str: InterpreterBase.STRING_DEF, type(None): InterpreterBase.NIL_DEF}
+    LITERALS = (InterpreterBase.INT_DEF, InterpreterBase.BOOL_DEF,
+                InterpreterBase.STRING_DEF, InterpreterBase.NIL_DEF)
+
+    def __init__(self, interpreter_instance):
+        self.inter_instance = interpreter_instance
+
+    def fold_program(self, ast):
+        for func in ast.get("functions"):
+            self.fold_statements(func.get("statements"))
+
+    def fold_statements(self, statements):
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == "=" or kind == InterpreterBase.RETURN_DEF:
+                if statement.get("expression") is not None:
+                    self.fold_expression(statement.get("expression"))
+            elif kind == InterpreterBase.IF_DEF:
+                self.fold_expression(statement.get("condition"))
+                self.fold_statements(statement.get("statements"))
+                if statement.get("else_statements") is not None:
+                    self.fold_statements(statement.get("else_statements"))
+            elif kind == InterpreterBase.WHILE_DEF:
+                self.fold_expression(statement.get("condition"))
+                self.fold_statements(statement.get("statements"))
+            else:
+                self.fold_expression(statement)
+
+    # returns True if node is (or has been folded into) a literal
+    def fold_expression(self, node):
+        kind = node.elem_type
+        if kind in self.LITERALS:
+            return True
+        if kind == InterpreterBase.LAMBDA_DEF:
+            self.fold_statements(node.get("statements"))
+            return False
+        if kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            #folding a prompt would change what gets printed
+            if kind == InterpreterBase.FCALL_DEF and node.get("name") in ("inputi", "inputs"):
+                return False
+            for arg in node.get("args"):
+                self.fold_expression(arg)
+            return False
+        if kind == InterpreterBase.VAR_DEF or kind == InterpreterBase.OBJ_DEF:
+            return False
+
+        op1 = node.get("op1")
+        op2 = node.get("op2")
+        #fold both operands even if only one of them turns out constant
+        op1_constant = self.fold_expression(op1)
+        op2_constant = op2 is None or self.fold_expression(op2)
+        if not op1_constant or not op2_constant:
+            return False
+
+        if kind == "*" and (isinstance(op1.get("val"), str) or isinstance(op2.get("val"), str)):
+            return False
+
+        inter_instance = self.inter_instance
+        error_type, error_line = inter_instance.get_error_type_and_line()
+        try:
+            if op2 is None:
+                value = inter_instance.apply_unary_operator(kind, op1.get("val"))
+            else:
+                value = inter_instance.apply_binary_operator(kind, op1.get("val"), op2.get("val"))
+        except (TypeError, ZeroDivisionError):
+            #python errors like 1 + "a" or 1 / 0, which happen at runtime too
+            return False
+        except Exception as exception:
+            #error() raises a plain Exception; anything else is a bug folding shouldn't hide
+            if type(exception) is not Exception:
+                raise
+            #leave the error for runtime, and forget we ever saw it
+            inter_instance.error_type = error_type
+            inter_instance.error_line = error_line
+            return False
+
+        node.elem_type = self.LITERAL_TYPES[type(value)]
+        node.val = value
+        node.op1 = None
+        node.op2 = None
+        return True
+
+
+class TailCallAnalyzer:
+    """
+    Finds the functions and lambdas that a 'return f(...)' may jump to after the caller has
+    already left, instead of calling them on top of the caller. Brewin is dynamically scoped,
+    so that is only safe for code that can't see the caller's variables: it must only use its
+    own (by value) parameters, can't create lambdas or use methods or 'this', and may only call
+    builtins and top-level functions that are safe in the same way.
+
+    It may also 'return v(...)' through a variable, whose value is only known when it runs (the
+    interpreter only jumps to it if it is tail_callable, and calls it normally otherwise). Such
+    code, and code that calls it, is marked calls_variable: it can only replace a call of
+    itself, so the callers it leaves behind are copies of it that bind the same names it does.
+
+    Annotates nodes with:
+      return nodes: tail_call (True if the returned expression is a function call), and
+        returns_from (the func or lambda node the return is in)
+      func and lambda nodes: tail_callable and calls_variable
+    """
+
+    BUILTINS = ("print", "inputi", "inputs")
+
+    def analyze_program(self, ast):
+        functions = {}  # (name, number of args) -> func node
+        for func in ast.get("functions"):
+            functions[(func.get("name"), len(func.get("args")))] = func
+        self.function_names = set(name for name, _ in functions)
+
+        #calls[node] holds the (name, number of args) of the top-level functions node calls
+        self.calls = {}
+        for func in functions.values():
+            self.analyze_function(func)
+
+        #a function that calls something unsafe is unsafe too, repeat until nothing changes
+        changed = True
+        while changed:
+            changed = False
+            for node, calls in self.calls.items():
+                if node.tail_callable and not all(
+                        call in functions and functions[call].tail_callable for call in calls):
+                    node.tail_callable = False
+                    changed = True
+                if not node.calls_variable and any(
+                        call in functions and functions[call].calls_variable for call in calls):
+                    node.calls_variable = True
+                    changed = True
+
+    # func and lambda nodes
+    def analyze_function(self, func_node):
+        params = set(arg.get("name") for arg in func_node.get("args"))
+        func_node.tail_callable = all(
+            arg.elem_type == InterpreterBase.ARG_DEF for arg in func_node.get("args"))
+        func_node.calls_variable = False
+        self.current = func_node
+        self.current_params = params
+        self.calls[func_node] = []
+        self.analyze_statements(func_node.get("statements"))
+
+    def analyze_statements(self, statements):
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == "=":
+                self.check_name(statement.get("name"))
+                self.analyze_expression(statement.get("expression"))
+            elif kind == InterpreterBase.IF_DEF:
+                self.analyze_expression(statement.get("condition"))
+                self.analyze_statements(statement.get("statements"))
+                if statement.get("else_statements") is not None:
+                    self.analyze_statements(statement.get("else_statements"))
+            elif kind == InterpreterBase.WHILE_DEF:
+                self.analyze_expression(statement.get("condition"))
+                self.analyze_statements(statement.get("statements"))
+            elif kind == InterpreterBase.RETURN_DEF:
+                expression = statement.get("expression")
+                statement.tail_call = (expression is not None and
+                                       expression.elem_type == InterpreterBase.FCALL_DEF)
+                statement.returns_from = self.current
+                if statement.tail_call:
+                    self.analyze_call(expression, True)
+                elif expression is not None:
+                    self.analyze_expression(expression)
+            else:
+                self.analyze_expression(statement)
+
+    # var and '=' names must be (a field of) a parameter
+    def check_name(self, var_name):
+        if "." in var_name:
+            var_name = var_name[0:var_name.index(".")]
+        if var_name not in self.current_params:
+            self.current.tail_callable = False
+
+    def analyze_expression(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_DEF:
+            self.check_name(node.get("name"))
+        elif kind == InterpreterBase.FCALL_DEF:
+            self.analyze_call(node, False)
+        elif kind == InterpreterBase.MCALL_DEF:
+            self.current.tail_callable = False
+            for arg in node.get("args"):
+                self.analyze_expression(arg)
+        elif kind == InterpreterBase.LAMBDA_DEF:
+            self.current.tail_callable = False
+            enclosing, enclosing_params = self.current, self.current_params
+            self.analyze_function(node)
+            self.current, self.current_params = enclosing, enclosing_params
+        else:
+            if node.get("op1") is not None:
+                self.analyze_expression(node.get("op1"))
+            if node.get("op2") is not None:
+                self.analyze_expression(node.get("op2"))
+
+    # fcall nodes; is_tail_call is True for the expression of a return
+    def analyze_call(self, node, is_tail_call):
+        name = node.get("name")
+        #builtins, then top-level functions, are called before variables of the same name
+        if name in self.function_names and name not in self.BUILTINS:
+            self.calls[self.current].append((name, len(node.get("args"))))
+        elif name not in self.BUILTINS:
+            #anything but a tail call to a variable could run code that sees the caller's variables
+            if is_tail_call:
+                self.current.calls_variable = True
+            else:
+                self.current.tail_callable = False
+        for arg in node.get("args"):
+            self.analyze_expression(arg)
+
+
+class FreeVariableAnalyzer:
+    """
+    Finds the variables each lambda can use so evaluate_lambda only captures those. Run after
+    SlotResolver.
+
+    Names are dynamically scoped, so anything the lambda calls could read any captured variable.
+    Lambdas that call functions, lambdas or methods (anything but builtins), or that create
+    such a lambda, still capture everything in scope.
+
+    A lambda that only calls builtins, creates no lambdas and never assigns 'this' can't let
+    other code see its captured variables, so its body reads and writes them straight from
+    the lambda's closure_vars (its cells) instead of pushing them onto the variable stacks.
+
+    Annotates nodes with:
+      lambda nodes: free_slots (tuple of slots used by the body other than parameters, or None
+        to capture everything), and uses_cells
+      var and '=' nodes: cell (True if the node is in the body of a lambda that uses_cells and
+        names one of its free slots, either as the variable or as the object of a field)
+    """
+
+    BUILTINS = ("print", "inputi", "inputs")
+
+    def analyze_program(self, ast):
+        self.targets = []  # var and '=' nodes of the body being analyzed
+        self.needs_stacks = False  # if the body being analyzed can't use cells
+        for func in ast.get("functions"):
+            self.analyze_statements(func.get("statements"), set())
+
+    # returns the slots used by the lambda's body (or None), and annotates the lambda with them
+    def analyze_lambda(self, lambda_node):
+        enclosing_targets, enclosing_needs_stacks = self.targets, self.needs_stacks
+        self.targets, self.needs_stacks = [], False
+        used = set()
+        if self.analyze_statements(lambda_node.get("statements"), used):
+            used.difference_update(arg.slot for arg in lambda_node.get("args"))
+            lambda_node.free_slots = tuple(sorted(used))
+        else:
+            lambda_node.free_slots = None
+
+        lambda_node.uses_cells = lambda_node.free_slots is not None and not self.needs_stacks
+        if lambda_node.uses_cells:
+            for node in self.targets:
+                node.cell = node.slot in used or node.object_slot in used
+        self.targets, self.needs_stacks = enclosing_targets, enclosing_needs_stacks
+        return lambda_node.free_slots
+
+    # adds slots used by statements to used; returns False if they can use any variable
+    def analyze_statements(self, statements, used):
+        closed = True
+        for statement in statements:
+            kind = statement.elem_type
+            if kind == "=":
+                self.add_target(statement, used)
+                #'this' is bound to a variable of the caller
+                if statement.get("name") == InterpreterBase.THIS_DEF:
+                    self.needs_stacks = True
+                closed &= self.analyze_expression(statement.get("expression"), used)
+            elif kind == InterpreterBase.IF_DEF:
+                closed &= self.analyze_expression(statement.get("condition"), used)
+                closed &= self.analyze_statements(statement.get("statements"), used)
+                if statement.get("else_statements") is not None:
+                    closed &= self.analyze_statements(statement.get("else_statements"), used)
+            elif kind == InterpreterBase.WHILE_DEF:
+                closed &= self.analyze_expression(statement.get("condition"), used)
+                closed &= self.analyze_statements(statement.get("statements"), used)
+            elif kind == InterpreterBase.RETURN_DEF:
+                if statement.get("expression") is not None:
+                    closed &= self.analyze_expression(statement.get("expression"), used)
+            else:
+                closed &= self.analyze_expression(statement, used)
+        return closed
+
+    # var and '=' nodes
+    def add_target(self, node, used):
+        node.cell = False
+        self.targets.append(node)
+        if node.slot is not None:
+            used.add(node.slot)
+        if node.object_slot is not None:
+            used.add(node.object_slot)
+
+    def analyze_expression(self, node, used):
+        kind = node.elem_type
+        closed = True
+        if kind == InterpreterBase.VAR_DEF:
+            self.add_target(node, used)
+        elif kind == InterpreterBase.FCALL_DEF:
+            closed = node.get("name") in self.BUILTINS
+            for arg in node.get("args"):
+                closed &= self.analyze_expression(arg, used)
+        elif kind == InterpreterBase.MCALL_DEF:
+            closed = False
+            for arg in node.get("args"):
+                self.analyze_expression(arg, used)
+        elif kind == InterpreterBase.LAMBDA_DEF:
+            #the inner lambda captures from the scope this lambda's body runs in
+            self.needs_stacks = True
+            free_slots = self.analyze_lambda(node)
+            if free_slots is None:
+                closed = False
+            else:
+                used.update(free_slots)
+        else:
+            if node.get("op1") is not None:
+                closed &= self.analyze_expression(node.get("op1"), used)
+            if node.get("op2") is not None:
+                closed &= self.analyze_expression(node.get("op2"), used)
+        return closed
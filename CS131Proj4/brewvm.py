@@ -0,0 +1,490 @@
+"""
+Bytecode compiler and stack VM for the v4 Brewin interpreter.
+
+Statement lists are compiled once into flat lists of (opcode, arg) pairs and run on a single
+dispatch loop. Scoping, objects and operators still go through the Interpreter's own runtime
+methods, so both engines share the same semantics and errors.
+
+Calls to Brewin functions, lambdas and methods don't recurse in Python: the VM saves the
+caller's state in a frame on its own call stack and runs the callee in the same loop, so
+recursion depth is limited by the interpreter's max_call_depth instead of Python's
+recursion limit.
+"""
+
+from intbase import InterpreterBase, ErrorType
+from cell import Cell
+from completion import Return
+
+# opcodes, in the order the dispatch loop checks them (roughly how often it sees them)
+LOAD = 0  # push value of a plain variable, arg is (slot, var node)
+CONST = 1  # push constant arg
+BINARY_VAR_CONST = 2  # push result of a binary operator on a plain variable and a constant,
+                      # arg is (operator, slot, var node, constant, store slot)
+                      # if store slot isn't None the result is stored there instead, like STORE
+BINARY_VAR_VAR = 3  # BINARY_VAR_CONST on two plain variables,
+                    # arg is (operator, slot, var node, slot, var node, store slot)
+JUMP_IF_FALSE = 4  # pop value, raise TYPE_ERROR if it can't be used as a condition,
+                   # jump to arg if false
+JUMP = 5  # jump to arg
+STORE = 6  # pop value into plain variable with slot arg
+BINARY = 7  # pop two operands, push result of binary operator arg
+RESOLVE_CALL = 8  # find the function or lambda called by fcall node arg
+BIND_VALUE = 9  # pop value into parameter arg of the innermost resolved call
+BIND_VAR = 10  # bind var node to a parameter of the innermost resolved call, arg is (index, node)
+CALL = 11  # enter the innermost resolved call once its arguments are bound
+TAIL_CALL = 12  # CALL for return node arg ('return f(...)'), leaving the caller first if the target allows it
+RETURN = 13  # pop return value and leave the function
+RETURN_NIL = 14  # leave the function returning nil
+END = 15  # end of a function body, leave the function returning nil
+POP = 16  # discard top of stack
+RESOLVE_METHOD = 17  # find the method called by mcall node arg and make its object 'this'
+UNARY = 18  # pop operand, push result of unary operator arg
+LOAD_SLOW = 19  # push value of var node arg ('this' or lambda cell)
+STORE_SLOW = 20  # pop value into target of '=' node arg ('this' or lambda cell)
+LOAD_FIELD = 21  # push value of the object field named by var node arg
+STORE_FIELD = 22  # pop value into the object field named by '=' node arg
+PRINT_ARG = 23  # pop value, append its printed form to the string under it
+PRINT = 24  # pop string and print it, push nil
+NEW_OBJ = 25  # push new empty object
+LAMBDA = 26  # push closure for lambda node arg
+ENTER_BLOCK = 27  # open an if/while block that may create the variables with slots arg
+EXIT_BLOCK = 28  # pop variables created by the innermost block
+HALT = 29  # pop and return value of a compiled expression
+SHORT_CIRCUIT = 30  # if top of stack decides '&&'/'||', replace it with the result and jump,
+                    # arg is (operator, jump target)
+BUILTIN = 31  # push result of inputi/inputs for fcall node arg
+
+
+class BytecodeEngine:
+    def __init__(self, interpreter_instance):
+        self.inter_instance = interpreter_instance
+        self.block_code = {}  # id(statement list) -> compiled code
+        self.expression_code = {}  # id(expression node) -> compiled code
+
+    # replace the interpreter's block and expression runners with compiled ones
+    def install(self, ast):
+        for func in ast.get("functions"):
+            self.get_block_code(func.get("statements"))
+        self.inter_instance.run_block = self.run_block
+        self.inter_instance.evaluate_expression = self.evaluate_expression
+
+    # only function and lambda bodies are compiled as blocks, if/while blocks are inlined
+    def get_block_code(self, statements):
+        code = self.block_code.get(id(statements))
+        if code is None:
+            code = []
+            self.compile_statements(code, statements)
+            code.append((END, None))
+            self.block_code[id(statements)] = code
+        return code
+
+    def run_block(self, statements):
+        return self.execute(self.get_block_code(statements))
+
+    def evaluate_expression(self, expression_node):
+        code = self.expression_code.get(id(expression_node))
+        if code is None:
+            code = []
+            self.compile_expression(code, expression_node)
+            code.append((HALT, None))
+            self.expression_code[id(expression_node)] = code
+        return self.execute(code)
+
+    def compile_statements(self, code, statements):
+        for statement in statements:
+            self.compile_statement(code, statement)
+
+    def compile_statement(self, code, statement):
+        kind = statement.elem_type
+        if kind == "=":
+            if statement.field_name is None and statement.slot is not None and not statement.cell:
+                superinstruction = self.get_superinstruction(statement.get("expression"), statement.slot)
+                if superinstruction is not None:
+                    code.append(superinstruction)
+                    return
+            self.compile_expression(code, statement.get("expression"))
+            if statement.field_name is not None:
+                code.append((STORE_FIELD, statement))
+            elif statement.slot is None or statement.cell:
+                code.append((STORE_SLOW, statement))
+            else:
+                code.append((STORE, statement.slot))
+        elif kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            self.compile_expression(code, statement)
+            code.append((POP, None))
+        elif kind == InterpreterBase.IF_DEF:
+            self.compile_if(code, statement)
+        elif kind == InterpreterBase.WHILE_DEF:
+            self.compile_while(code, statement)
+        elif kind == InterpreterBase.RETURN_DEF:
+            expression = statement.get("expression")
+            if expression is None:
+                code.append((RETURN_NIL, None))
+            else:
+                if statement.tail_call:
+                    self.compile_call(code, expression, TAIL_CALL, statement)
+                else:
+                    self.compile_expression(code, expression)
+                code.append((RETURN, None))
+        # any other expression used as a statement is never evaluated, same as run_statement
+
+    def compile_if(self, code, if_node):
+        self.compile_expression(code, if_node.get("condition"))
+        jump_to_else = len(code)
+        code.append(None)  # patched below
+        self.compile_block(code, if_node.get("statements"), if_node.new_vars)
+        else_statements = if_node.get("else_statements")
+        if else_statements is None:
+            code[jump_to_else] = (JUMP_IF_FALSE, len(code))
+            return
+        jump_to_end = len(code)
+        code.append(None)
+        code[jump_to_else] = (JUMP_IF_FALSE, len(code))
+        self.compile_block(code, else_statements, if_node.else_new_vars)
+        code[jump_to_end] = (JUMP, len(code))
+
+    # the condition is evaluated and type checked once per iteration
+    def compile_while(self, code, while_node):
+        new_vars = while_node.new_vars
+        if new_vars:
+            code.append((ENTER_BLOCK, new_vars))
+        loop_start = len(code)
+        self.compile_expression(code, while_node.get("condition"))
+        jump_to_end = len(code)
+        code.append(None)
+        self.compile_statements(code, while_node.get("statements"))
+        code.append((JUMP, loop_start))
+        code[jump_to_end] = (JUMP_IF_FALSE, len(code))
+        if new_vars:
+            code.append((EXIT_BLOCK, None))
+
+    # blocks that never create variables don't need a scope
+    def compile_block(self, code, statements, new_vars):
+        if new_vars:
+            code.append((ENTER_BLOCK, new_vars))
+        self.compile_statements(code, statements)
+        if new_vars:
+            code.append((EXIT_BLOCK, None))
+
+    # a call resolves its target first, then binds each argument as it is evaluated
+    # (same order as run_function), then enters the target with call_op
+    # return_node is the return statement of a TAIL_CALL
+    def compile_call(self, code, call_node, call_op, return_node=None):
+        if call_node.elem_type == InterpreterBase.MCALL_DEF:
+            code.append((RESOLVE_METHOD, call_node))
+        else:
+            name = call_node.get("name")
+            if name == "print":
+                code.append((CONST, ""))
+                for arg in call_node.get("args"):
+                    self.compile_expression(code, arg)
+                    code.append((PRINT_ARG, None))
+                code.append((PRINT, None))
+                return
+            if name == "inputi" or name == "inputs":
+                code.append((BUILTIN, call_node))
+                return
+            code.append((RESOLVE_CALL, call_node))
+        for index, arg in enumerate(call_node.get("args")):
+            # variables may be passed by reference, depending on the target
+            if arg.elem_type == InterpreterBase.VAR_DEF:
+                code.append((BIND_VAR, (index, arg)))
+            else:
+                self.compile_expression(code, arg)
+                code.append((BIND_VALUE, index))
+        code.append((call_op, return_node))
+
+    def compile_expression(self, code, expression_node):
+        kind = expression_node.elem_type
+        if kind == InterpreterBase.VAR_DEF:
+            if expression_node.field_name is not None:
+                code.append((LOAD_FIELD, expression_node))
+            elif expression_node.slot is None or expression_node.cell:
+                code.append((LOAD_SLOW, expression_node))
+            else:
+                code.append((LOAD, (expression_node.slot, expression_node)))
+        elif (kind == InterpreterBase.INT_DEF or kind == InterpreterBase.STRING_DEF or
+              kind == InterpreterBase.BOOL_DEF or kind == InterpreterBase.NIL_DEF):
+            code.append((CONST, expression_node.get("val")))
+        elif kind == InterpreterBase.FCALL_DEF or kind == InterpreterBase.MCALL_DEF:
+            self.compile_call(code, expression_node, CALL)
+        elif kind == InterpreterBase.NEG_DEF or kind == InterpreterBase.NOT_DEF:
+            self.compile_expression(code, expression_node.get("op1"))
+            code.append((UNARY, kind))
+        elif kind == InterpreterBase.LAMBDA_DEF:
+            code.append((LAMBDA, expression_node))
+        elif kind == InterpreterBase.OBJ_DEF:
+            code.append((NEW_OBJ, None))
+        elif (kind == "&&" or kind == "||") and self.inter_instance.short_circuit:
+            self.compile_expression(code, expression_node.get("op1"))
+            short_circuit = len(code)
+            code.append(None)
+            self.compile_expression(code, expression_node.get("op2"))
+            code.append((BINARY, kind))
+            code[short_circuit] = (SHORT_CIRCUIT, (kind, len(code)))
+        else:
+            superinstruction = self.get_superinstruction(expression_node, None)
+            if superinstruction is not None:
+                code.append(superinstruction)
+                return
+            self.compile_expression(code, expression_node.get("op1"))
+            self.compile_expression(code, expression_node.get("op2"))
+            code.append((BINARY, kind))
+
+    # returns the BINARY_VAR_CONST or BINARY_VAR_VAR instruction for expression_node, storing
+    # into store_slot (None to push), or None if it isn't a binary operator on those operands
+    # ('&&' and '||' are only compiled this way when they don't short circuit)
+    def get_superinstruction(self, expression_node, store_slot):
+        kind = expression_node.elem_type
+        op1 = expression_node.get("op1")
+        op2 = expression_node.get("op2")
+        # only operator nodes have op2, and only binary ones set it
+        if op2 is None:
+            return None
+        if (kind == "&&" or kind == "||") and self.inter_instance.short_circuit:
+            return None
+        if not self.is_plain_variable(op1):
+            return None
+        if self.is_plain_variable(op2):
+            return (BINARY_VAR_VAR, (kind, op1.slot, op1, op2.slot, op2, store_slot))
+        kind2 = op2.elem_type
+        if (kind2 == InterpreterBase.INT_DEF or kind2 == InterpreterBase.STRING_DEF or
+                kind2 == InterpreterBase.BOOL_DEF or kind2 == InterpreterBase.NIL_DEF):
+            return (BINARY_VAR_CONST, (kind, op1.slot, op1, op2.get("val"), store_slot))
+        return None
+
+    # var nodes compiled to LOAD
+    def is_plain_variable(self, node):
+        return (node.elem_type == InterpreterBase.VAR_DEF and node.field_name is None
+                and node.slot is not None and not node.cell)
+
+    # runs compiled code, along with every Brewin call it makes
+    # returns the Return record (or None if there was no return) for block code, or the value
+    # of expression code
+    def execute(self, code):
+        inter_instance = self.inter_instance
+        variable_slots = inter_instance.variable_slots
+        max_call_depth = inter_instance.max_call_depth
+        apply_binary_operator = inter_instance.apply_binary_operator
+        evaluate_variable = inter_instance.evaluate_variable
+        # the opcodes checked first, as locals since comparing op to them is faster than to globals
+        load, const, binary_var_const, binary_var_var = LOAD, CONST, BINARY_VAR_CONST, BINARY_VAR_VAR
+        jump_if_false, jump, store, binary = JUMP_IF_FALSE, JUMP, STORE, BINARY
+        resolve_call, bind_value, bind_var, call, tail_call = (
+            RESOLVE_CALL, BIND_VALUE, BIND_VAR, CALL, TAIL_CALL)
+        stack = []
+        pc = 0
+        blocks = []  # variables created by each open if/while block of the current function
+        calls = []  # (target, binding plan, is function, is method) of calls being set up
+        frames = []  # (code, pc, stack, blocks) of each caller, then the callee's
+                     # (target, is function, variables created by its body, is method)
+        while True:
+            op, arg = code[pc]
+            pc += 1
+            if op == load:
+                var_stack = variable_slots[arg[0]]
+                if var_stack:
+                    value = var_stack[-1]
+                    #if variable is a reference, look up the referenced value
+                    if type(value) is Cell:
+                        value = value.value
+                    stack.append(value)
+                else:
+                    #function name, or an undefined variable error
+                    stack.append(evaluate_variable(arg[1]))
+            elif op == const:
+                stack.append(arg)
+            elif op == binary_var_const:
+                # the variable is read the same way as LOAD, the result stored the same way as STORE
+                operator, slot, var_node, op2_value, store_slot = arg
+                var_stack = variable_slots[slot]
+                if var_stack:
+                    value = var_stack[-1]
+                    if type(value) is Cell:
+                        value = value.value
+                else:
+                    value = evaluate_variable(var_node)
+                value = apply_binary_operator(operator, value, op2_value)
+                if store_slot is None:
+                    stack.append(value)
+                else:
+                    var_stack = variable_slots[store_slot]
+                    if var_stack:
+                        top = var_stack[-1]
+                        if type(top) is Cell:
+                            top.value = value
+                        else:
+                            var_stack[-1] = value
+                    else:
+                        var_stack.append(value)
+            elif op == binary_var_var:
+                operator, slot, var_node, slot2, var_node2, store_slot = arg
+                var_stack = variable_slots[slot]
+                if var_stack:
+                    value = var_stack[-1]
+                    if type(value) is Cell:
+                        value = value.value
+                else:
+                    value = evaluate_variable(var_node)
+                var_stack = variable_slots[slot2]
+                if var_stack:
+                    op2_value = var_stack[-1]
+                    if type(op2_value) is Cell:
+                        op2_value = op2_value.value
+                else:
+                    op2_value = evaluate_variable(var_node2)
+                value = apply_binary_operator(operator, value, op2_value)
+                if store_slot is None:
+                    stack.append(value)
+                else:
+                    var_stack = variable_slots[store_slot]
+                    if var_stack:
+                        top = var_stack[-1]
+                        if type(top) is Cell:
+                            top.value = value
+                        else:
+                            var_stack[-1] = value
+                    else:
+                        var_stack.append(value)
+            elif op == jump_if_false:
+                value = stack.pop()
+                if not isinstance(value, int):
+                    inter_instance.error(ErrorType.TYPE_ERROR,
+                                "condition does not evaluate to boolean")
+                if not value:
+                    pc = arg
+            elif op == jump:
+                pc = arg
+            elif op == store:
+                value = stack.pop()
+                var_stack = variable_slots[arg]
+                if var_stack:
+                    top = var_stack[-1]
+                    if type(top) is Cell:
+                        top.value = value
+                    else:
+                        var_stack[-1] = value
+                else:
+                    var_stack.append(value)
+            elif op == binary:
+                op2_value = stack.pop()
+                stack[-1] = apply_binary_operator(arg, stack[-1], op2_value)
+            elif op == resolve_call:
+                target = inter_instance.resolve_call(arg)
+                calls.append(self.describe_call(target, False))
+            elif op == bind_value:
+                target, binding_plan, is_function, is_method = calls[-1]
+                inter_instance.bind_value(binding_plan[arg][0], stack.pop(), is_function)
+            elif op == bind_var:
+                target, binding_plan, is_function, is_method = calls[-1]
+                arg_slot, is_ref = binding_plan[arg[0]]
+                var_node = arg[1]
+                if is_ref:
+                    inter_instance.bind_reference(arg_slot, var_node)
+                else:
+                    var_stack = None
+                    if var_node.slot is not None:
+                        var_stack = variable_slots[var_node.slot]
+                    if var_stack:
+                        value = var_stack[-1]
+                        if type(value) is Cell:
+                            value = value.value
+                    else:
+                        value = evaluate_variable(var_node)
+                    inter_instance.bind_value(arg_slot, value, is_function)
+            elif op == call or op == tail_call:
+                target, binding_plan, is_function, is_method = calls.pop()
+                target_node = target.function_node if is_function else target.lambda_node
+                if op == tail_call and inter_instance.can_replace_caller(target, target_node,
+                                                                         arg.returns_from):
+                    #take the arguments back, and leave the caller before entering the target
+                    arg_values = [variable_slots[arg_slot].pop() for arg_slot, is_ref in reversed(binding_plan)]
+                    arg_values.reverse()
+                    while blocks:
+                        inter_instance.clean_block_scope(blocks.pop())
+                    if not frames:
+                        #the caller was entered by run_function/run_lambda, which runs the target
+                        return inter_instance.return_tail_call(target, arg_values)
+                    code, pc, stack, blocks = self.leave_frame(frames.pop())
+                    for (arg_slot, is_ref), arg_value in zip(binding_plan, arg_values):
+                        variable_slots[arg_slot].append(arg_value)
+                if is_function:
+                    local_vars = inter_instance.get_new_block_vars(target_node.new_vars)
+                else:
+                    target.inter_instance = inter_instance
+                    local_vars = target.enter_lambda_scope()
+                frames.append((code, pc, stack, blocks, target, is_function, local_vars, is_method))
+                if len(frames) > max_call_depth:
+                    raise RecursionError("maximum Brewin call depth exceeded")
+                code = self.get_block_code(target_node.get("statements"))
+                pc = 0
+                stack = []
+                blocks = []
+            elif op == RETURN or op == RETURN_NIL or op == END:
+                return_value = None
+                if op == RETURN:
+                    return_value = inter_instance.copy_return_value(stack.pop())
+                #close every block opened by this function, innermost first
+                while blocks:
+                    inter_instance.clean_block_scope(blocks.pop())
+                if not frames:
+                    if op == END:
+                        return None
+                    return Return(return_value)
+                code, pc, stack, blocks = self.leave_frame(frames.pop())
+                stack.append(return_value)
+            elif op == POP:
+                stack.pop()
+            elif op == RESOLVE_METHOD:
+                target = inter_instance.resolve_method_call(arg)
+                calls.append(self.describe_call(target, True))
+            elif op == UNARY:
+                stack[-1] = inter_instance.apply_unary_operator(arg, stack[-1])
+            elif op == LOAD_SLOW:
+                stack.append(evaluate_variable(arg))
+            elif op == STORE_SLOW:
+                inter_instance.do_assignment(arg, stack.pop())
+            elif op == LOAD_FIELD:
+                obj = inter_instance.get_object(arg.object_name, arg.object_slot, arg.cell)
+                stack.append(obj.get_field(arg.field_name))
+            elif op == STORE_FIELD:
+                obj = inter_instance.get_object(arg.object_name, arg.object_slot, arg.cell)
+                obj.assign_field(arg.field_name, stack.pop(), inter_instance)
+            elif op == PRINT_ARG:
+                value = stack.pop()
+                stack[-1] += inter_instance.to_print_string(value)
+            elif op == PRINT:
+                inter_instance.output(stack.pop())
+                stack.append(None)
+            elif op == NEW_OBJ:
+                stack.append(inter_instance.create_object())
+            elif op == LAMBDA:
+                stack.append(inter_instance.evaluate_lambda(arg))
+            elif op == ENTER_BLOCK:
+                blocks.append(inter_instance.get_new_block_vars(arg))
+            elif op == EXIT_BLOCK:
+                inter_instance.clean_block_scope(blocks.pop())
+            elif op == HALT:
+                return stack.pop()
+            elif op == SHORT_CIRCUIT:
+                if inter_instance.short_circuits(arg[0], stack[-1]):
+                    stack[-1] = arg[0] == "||"
+                    pc = arg[1]
+            elif op == BUILTIN:
+                stack.append(inter_instance.do_func_call(arg))
+
+    # entry for the calls stack; target is a Function or a Lambda
+    def describe_call(self, target, is_method):
+        return (target, target.binding_plan, hasattr(target, "function_node"), is_method)
+
+    # unbinds the callee of frame (its blocks are already closed)
+    # returns the caller's (code, pc, stack, blocks)
+    def leave_frame(self, frame):
+        code, pc, stack, blocks, target, is_function, local_vars, is_method = frame
+        if is_function:
+            self.inter_instance.leave_function_scope(target.function_node, local_vars)
+        else:
+            target.leave_lambda_scope(local_vars)
+        if is_method:
+            self.inter_instance.child_object.pop()
+        return code, pc, stack, blocks
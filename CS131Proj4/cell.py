@@ -0,0 +1,11 @@
+# binding of a variable that ref parameters or lambda closures also refer to; variable
+# stacks hold plain values, and a binding is moved into a Cell the first time it's shared
+class Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    # copies of a lambda still refer to the same variable
+    def __deepcopy__(self, memo):
+        return self
@@ -0,0 +1,7 @@
+# how a block finished: running a block gives back None if it ran to its end, or a Return
+# record if a return statement left it (the record is passed up to the function or lambda)
+class Return:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value  # value being returned, or a TailCall to run in its place
@@ -1,19 +1,34 @@
+from intbase import InterpreterBase
+
+
 class Element:
+    # attributes a node of this type is built with; get() returns None for any other name
+    FIELDS = ()
+
+    __slots__ = ("elem_type",)
+
+    # Element(elem_type, ...) builds the node class for elem_type
+    def __new__(cls, elem_type, **kwargs):
+        if cls is Element:
+            cls = NODE_CLASSES.get(elem_type, OperatorElement)
+        return object.__new__(cls)
+
     def __init__(self, elem_type, **kwargs):
         self.elem_type = elem_type
-        self.dict = {}
+        for key in self.FIELDS:
+            setattr(self, key, None)
         for key, value in kwargs.items():
-            self.dict[key] = value
+            setattr(self, key, value)
 
     def get(self, key):
-        if key not in self.dict:
-            return None
-        return self.dict[key]
+        return getattr(self, key, None)
 
     def __str__(self):
         s = f"{self.elem_type}: "
-        for key, value in self.dict.items():
-            s += key + ": " + self.__val(value) + ", "
+        for key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                s += key + ": " + self.__val(value) + ", "
         return s[0:-2]
 
     def __val(self, v):
@@ -27,3 +42,95 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+# one class per kind of node, with slots for its fields and for the annotations the passes in
+# brewpasses.py (and the interpreter's caches) put on it
+
+
+class ProgramElement(Element):
+    FIELDS = ("functions",)
+    __slots__ = FIELDS
+
+
+class FuncElement(Element):
+    FIELDS = ("name", "args", "statements")
+    __slots__ = FIELDS + ("param_slots", "binding_plan", "new_vars", "tail_callable", "calls_variable")
+
+
+class LambdaElement(Element):
+    FIELDS = ("args", "statements")
+    __slots__ = FIELDS + ("param_slots", "binding_plan", "new_vars", "tail_callable", "calls_variable",
+                          "free_slots", "uses_cells")
+
+
+class ArgElement(Element):
+    FIELDS = ("name",)
+    __slots__ = FIELDS + ("slot",)
+
+
+class AssignElement(Element):
+    FIELDS = ("name", "expression")
+    __slots__ = FIELDS + ("object_name", "field_name", "slot", "object_slot", "cell")
+
+
+class IfElement(Element):
+    FIELDS = ("condition", "statements", "else_statements")
+    __slots__ = FIELDS + ("new_vars", "else_new_vars")
+
+
+class WhileElement(Element):
+    FIELDS = ("condition", "statements")
+    __slots__ = FIELDS + ("new_vars",)
+
+
+class ReturnElement(Element):
+    FIELDS = ("expression",)
+    __slots__ = FIELDS + ("tail_call", "returns_from")
+
+
+class VarElement(Element):
+    FIELDS = ("name",)
+    __slots__ = FIELDS + ("object_name", "field_name", "slot", "object_slot", "cell")
+
+
+class FCallElement(Element):
+    FIELDS = ("name", "args")
+    __slots__ = FIELDS + ("slot", "call_target")
+
+
+class MCallElement(Element):
+    FIELDS = ("objref", "name", "args")
+    __slots__ = FIELDS + ("object_slot", "method_cache")
+
+
+class ValueElement(Element):
+    FIELDS = ("val",)
+    __slots__ = FIELDS
+
+
+# unary and binary operators; constant folding turns them into values in place
+class OperatorElement(Element):
+    FIELDS = ("op1", "op2", "val")
+    __slots__ = FIELDS
+
+
+NODE_CLASSES = {
+    InterpreterBase.PROGRAM_DEF: ProgramElement,
+    InterpreterBase.FUNC_DEF: FuncElement,
+    InterpreterBase.LAMBDA_DEF: LambdaElement,
+    InterpreterBase.ARG_DEF: ArgElement,
+    InterpreterBase.REFARG_DEF: ArgElement,
+    "=": AssignElement,
+    InterpreterBase.IF_DEF: IfElement,
+    InterpreterBase.WHILE_DEF: WhileElement,
+    InterpreterBase.RETURN_DEF: ReturnElement,
+    InterpreterBase.VAR_DEF: VarElement,
+    InterpreterBase.FCALL_DEF: FCallElement,
+    InterpreterBase.MCALL_DEF: MCallElement,
+    InterpreterBase.INT_DEF: ValueElement,
+    InterpreterBase.BOOL_DEF: ValueElement,
+    InterpreterBase.STRING_DEF: ValueElement,
+    InterpreterBase.NIL_DEF: ValueElement,
+    InterpreterBase.OBJ_DEF: ValueElement,
+}
@@ -1,126 +1,182 @@
 from intbase import InterpreterBase, ErrorType
 from brewparse import parse_program
+from cell import Cell
+from completion import Return
+from brewpasses import ConstantFolder, SlotResolver, BlockVarAnalyzer, TailCallAnalyzer, FreeVariableAnalyzer
 from collections import defaultdict
 import copy
+import weakref
+import operator
 
+#elem_type of binary operator nodes (the node type is the operator itself)
+BINARY_OPERATORS = ('+', '-', '*', '/', '==', '!=', '<', '<=', '>', '>=', '&&', '||')
+
+#never changed after it's made; evaluate_func_definitions makes the one each name refers to
 class Function:
+    __slots__ = ('function_node', 'binding_plan', 'num_args', 'func_name')
+
     def __init__(self, function_node):
         self.function_node = function_node
-        self.num_args = len(function_node.get("args"))
+        self.binding_plan = function_node.binding_plan #(slot, passed by ref) of each parameter
+        self.num_args = len(self.binding_plan)
         self.func_name = function_node.get("name")
 
+    #a copy is still a different value to '==' (returned functions are copies), so it has
+    #to be a new object, but it can reuse the fields instead of reading the node again
+    def copy(self):
+        copied = object.__new__(Function)
+        copied.function_node = self.function_node
+        copied.binding_plan = self.binding_plan
+        copied.num_args = self.num_args
+        copied.func_name = self.func_name
+        return copied
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+#returned in place of a value by 'return f(...)' when f can run after the caller has left
+class TailCall:
+    def __init__(self, target, arg_values):
+        self.target = target #Function or Lambda to call
+        self.arg_values = arg_values #already evaluated arguments, in parameter order
+
 class Lambda:
     def __init__(self, lambda_node, closure_vars, interpreter_instance):
         self.lambda_node = lambda_node
-        self.closure_vars = closure_vars #variables captured at time of lambda construction
-        self.parameters = lambda_node.get('args')
+        self.closure_vars = closure_vars #variable slot -> value captured at time of lambda construction
+        self.binding_plan = lambda_node.binding_plan #(slot, passed by ref) of each parameter
+        self.num_args = len(self.binding_plan)
         self.statements = lambda_node.get('statements')
         self.inter_instance = interpreter_instance #to access Interpreter methods and member variables
+        #slots of captured objects/lambdas still held as Cells of the creator's variables
+        self.ref_slots = [slot for slot, value in closure_vars.items() if type(value) is Cell]
+
+    #copies only the captured variables; the lambda node and interpreter are shared
+    #(the dict is built here rather than deep copied so the memo doesn't hold on to it)
+    def __deepcopy__(self, memo):
+        copied = Lambda(self.lambda_node, {}, self.inter_instance)
+        memo[id(self)] = copied
+        copied.closure_vars = {slot: copy.deepcopy(value, memo) for slot, value in self.closure_vars.items()}
+        copied.ref_slots = list(self.ref_slots)
+        return copied
 
     #run lambda using input args
     def run_lambda(self, input_args, interpreter_instance):
         self.inter_instance = interpreter_instance
-        local_vars = set() #variables that go out of scope once lambda ends
-        self.arg_names = set() #stores names of the parameter variables
 
         #if passing in mismatching arguments, throw error
-        if len(input_args) != len(self.parameters):
+        if len(input_args) != self.num_args:
             self.inter_instance.throw_unknown_lambda_error(len(input_args))
             
         #deal with parameters first
-        for i in range(len(self.parameters)):
-            arg = self.parameters[i]
-            arg_name = arg.get('name')
-            self.arg_names.add(arg_name)
-            input_arg = input_args[i]
-            local_vars.add(arg_name) #add arg as local variable
-
-            #if arg variable has not been created before
-            if arg_name not in self.inter_instance.variable_name_to_value:
-                self.inter_instance.variable_name_to_value[arg_name] = []
-            #pass var by reference
-            if arg.elem_type == 'refarg' and input_arg.elem_type == 'var':
-                #if input variable does not exist, throw error
-                if (input_arg.get('name') not in self.inter_instance.variable_name_to_value 
-                    and input_arg.get('name') not in self.inter_instance.function_and_arg_counts):
-                    self.inter_instance.throw_unknown_input_error(input_arg.get('name'))
-                #if input variable is a variable in current scope
-                elif input_arg.get('name') in self.inter_instance.variable_name_to_value:
-                    ref_var, idx = self.inter_instance.get_referenced_variable(self.inter_instance.variable_name_to_value, input_arg.get('name'))
-                    #if trying to reference a variable that is not a reference
-                    if idx == -1:
-                        idx = len(self.inter_instance.variable_name_to_value[input_arg.get('name')]) - 1
-                    #(idx of place in variable stack that is referred to, referred variable)
-                    self.inter_instance.variable_name_to_value[arg_name].append((idx, ref_var))
-                #if input variable is the name of a function
-                else:
-                    #assign corresponding function object to formal parameter
-                    self.inter_instance.variable_name_to_value[arg_name].append(self.inter_instance.evaluate_variable(self.inter_instance.variable_name_to_value, input_arg))
-            else:
-            #add input value as new value in the stack corresponding to variable name
-                input_arg_value = self.inter_instance.evaluate_expression(input_args[i])
-                self.inter_instance.variable_name_to_value[arg_name].append(input_arg_value)
-
-        #add previously captured variables to current scope
-        for closure_var_name, closure_var_value in self.closure_vars.items():
-            #if closure variable hasn't been shadowed by arg
-            if closure_var_name not in self.arg_names:
-                local_vars.add(closure_var_name)
+        self.inter_instance.bind_arguments(self.binding_plan, input_args, False)
 
-                #add closure variable to dict of all variables currently in-scope
-                if closure_var_name not in self.inter_instance.variable_name_to_value:
-                    self.inter_instance.variable_name_to_value[closure_var_name] = []
-                self.inter_instance.variable_name_to_value[closure_var_name].append(closure_var_value)
-                
-        for statement in self.statements:
-            #check if statement is assignment
-            if statement.elem_type == '=':
-                var_name = statement.get('name')
-                if var_name not in self.inter_instance.variable_name_to_value and '.' not in var_name and var_name != 'this':
-                    local_vars.add(var_name)
-                self.inter_instance.run_statement(statement)
-            else:
-                self.inter_instance.run_statement(statement)
-                if self.inter_instance.is_returning:
-                    #update closure var list so that if lambda is called again the updated values stay
-                    self.update_closure_vars()
-                    #clean scope because returning from function
-                    self.inter_instance.clean_scope(self.inter_instance.variable_name_to_value, local_vars)
-                    self.inter_instance.is_returning = False #set to false because we stop
-                        #returning once we return out of a function
-                    return self.inter_instance.return_value
+        #same as run_lambda_body, run here so an ordinary call doesn't take another python frame
+        local_vars = self.enter_lambda_scope()
+        completion = self.inter_instance.run_block(self.statements)
+        self.leave_lambda_scope(local_vars)
+        #we stop returning once we return out of the lambda
+        if completion is None:
+            return None
+        #'return f(...)' left the lambda so that f runs in its place
+        if type(completion.value) is TailCall:
+            return self.inter_instance.run_tail_calls(completion.value)
+        return completion.value
 
-        self.update_closure_vars()
-        self.inter_instance.clean_scope(self.inter_instance.variable_name_to_value, local_vars) 
-        self.inter_instance.is_returning = False
+    #runs the lambda once its parameters are bound, and unbinds them
+    #(for the calls run_tail_calls makes)
+    def run_lambda_body(self):
+        local_vars = self.enter_lambda_scope()
+        completion = self.inter_instance.run_block(self.statements)
+        self.leave_lambda_scope(local_vars)
+        #we stop returning once we return out of the lambda
+        if completion is not None:
+            return completion.value
         #return nil if no return statement in function
         return None  
     
+    #adds previously captured variables to current scope once parameters are bound
+    #returns the variables the lambda's body will create
+    def enter_lambda_scope(self):
+        self.inter_instance.running_lambdas.append(self)
+        #body reads and writes closure vars straight from closure_vars
+        if self.lambda_node.uses_cells:
+            self.inter_instance.closure_cells.append(self.closure_vars)
+            return self.inter_instance.get_new_block_vars(self.lambda_node.new_vars)
+        variable_slots = self.inter_instance.variable_slots
+        param_slots = self.lambda_node.param_slots #slots of the parameter variables
+        for closure_var_slot, closure_var_value in self.closure_vars.items():
+            #if closure variable hasn't been shadowed by arg
+            if closure_var_slot not in param_slots:
+                variable_slots[closure_var_slot].append(closure_var_value)
+        return self.inter_instance.get_new_block_vars(self.lambda_node.new_vars)
+
+    #cleans scope because we are leaving the lambda
+    def leave_lambda_scope(self, local_vars):
+        variable_slots = self.inter_instance.variable_slots
+        param_slots = self.lambda_node.param_slots
+        self.inter_instance.running_lambdas.pop()
+        if self.lambda_node.uses_cells:
+            self.inter_instance.closure_cells.pop()
+            #captured references hold their current value from now on, same as update_closure_vars
+            if self.ref_slots:
+                self.inter_instance.finish_lazy_copies()
+            for closure_var_slot in self.ref_slots:
+                self.closure_vars[closure_var_slot] = self.closure_vars[closure_var_slot].value
+            self.ref_slots = []
+            self.inter_instance.clean_block_scope(local_vars)
+            self.inter_instance.clean_scope(param_slots)
+            return
+        #update closure var list so that if lambda is called again the updated values stay
+        self.update_closure_vars()
+        self.inter_instance.clean_block_scope(local_vars)
+        for closure_var_slot in self.closure_vars:
+            if closure_var_slot not in param_slots:
+                variable_slots[closure_var_slot].pop()
+        self.inter_instance.clean_scope(param_slots)
+
     #update closure variables before returning to maintain new values for next lambda call
     def update_closure_vars(self):
-        for closure_var_name in self.closure_vars:
+        if self.inter_instance.lazy_copies:
+            self.inter_instance.finish_lazy_copies()
+        for closure_var_slot in self.closure_vars:
             #if closure var wasn't shadowed by formal parameter
-            if closure_var_name not in self.arg_names:
-                #if closure var is reference
-                if type(self.inter_instance.variable_name_to_value[closure_var_name][-1]) is tuple:
-                    ref_var, idx = self.inter_instance.get_referenced_variable(self.inter_instance.variable_name_to_value, closure_var_name)
-                    value = self.inter_instance.variable_name_to_value[ref_var][idx]
-                else:
-                    value = self.inter_instance.variable_name_to_value[closure_var_name][-1]
-                self.closure_vars[closure_var_name] = value
+            if closure_var_slot not in self.lambda_node.param_slots:
+                self.closure_vars[closure_var_slot] = self.inter_instance.get_variable(closure_var_slot)
 
-class Object(InterpreterBase):
-    def __init__(self, interpreter_instance, fields=None, parent=None):
-        if fields is None:
-            self.fields = {}
-        else:
-            self.fields = fields
+#field layout shared by every object whose fields were added in the same order
+class Shape:
+    def __init__(self, field_names):
+        self.field_names = field_names #tuple of field names, in the order they were added
+        self.field_index = {field_name: i for i, field_name in enumerate(field_names)}
+        self.transitions = {} #field name -> shape of an object of this shape once it gets that field
+
+    #shape of an object of this shape after field_name is added to it
+    def with_field(self, field_name):
+        shape = self.transitions.get(field_name)
+        if shape is None:
+            shape = Shape(self.field_names + (field_name,))
+            self.transitions[field_name] = shape
+        return shape
+
+class Object:
+    __slots__ = ('shape', 'values', 'parent', 'inter_instance', 'source', 'copy_memo',
+                 'lookup_cache', 'cache_epoch', 'is_prototype', '__weakref__')
+
+    def __init__(self, interpreter_instance, parent=None):
+        self.shape = interpreter_instance.empty_shape
+        self.values = [] #field values, in the order of shape.field_names
         self.parent = parent
         self.inter_instance = interpreter_instance
+        self.source = None #object this is a copy of, until the copy is made (see __deepcopy__)
+        self.copy_memo = None #deepcopy memo of the copy in progress
+        self.lookup_cache = None #inherited field name -> (object in prototype chain that has it, index)
+        self.cache_epoch = 0 #interpreter's proto_epoch when lookup_cache was made
+        self.is_prototype = False #set once the object is some object's proto
         #print("init " + str(self))
 
     def get_field(self, field_name):
-
+        self.finish_copy()
         #print(str(self))
         #if getting proto
         if field_name == 'proto':
@@ -128,17 +184,38 @@ class Object(InterpreterBase):
             if self.parent == None:
                 self.inter_instance.throw_unknown_field_error(field_name)
             return self.parent
+        idx = self.shape.field_index.get(field_name)
+        if idx is not None:
+            return self.values[idx]
+
+        #inherited fields are found through the cache until some prototype changes
+        proto_epoch = self.inter_instance.proto_epoch
+        cache = self.lookup_cache
+        if cache is not None and self.cache_epoch == proto_epoch:
+            holder = cache.get(field_name)
+            if holder is not None:
+                return holder[0].values[holder[1]]
+        else:
+            cache = self.lookup_cache = {}
+            self.cache_epoch = proto_epoch
+
         #if field doesn't exist, throw error
-        curr_obj = self
-        while field_name not in curr_obj.fields:
-            curr_obj = curr_obj.parent
+        curr_obj = self.parent
+        while True:
             if curr_obj == None:
                 self.inter_instance.throw_unknown_field_error(field_name)
-            
-        return curr_obj.fields[field_name][-1]
+            curr_obj.finish_copy()
+            idx = curr_obj.shape.field_index.get(field_name)
+            if idx is not None:
+                cache[field_name] = (curr_obj, idx)
+                return curr_obj.values[idx]
+            curr_obj = curr_obj.parent
     
     def assign_field(self, field_name, value, interpreter_instance):
         self.inter_instance = interpreter_instance
+        #lazy copies of this object (or of objects that lead to it) can't see the change
+        if interpreter_instance.lazy_copies:
+            interpreter_instance.finish_lazy_copies()
         #print(str(self))
         #if assigning prototype
         if field_name == 'proto':
@@ -146,42 +223,218 @@ class Object(InterpreterBase):
             if not isinstance(value, Object) and value != None:
                 self.inter_instance.throw_invalid_prototype_error()
             self.parent = value
+            self.lookup_cache = None
+            if value is not None:
+                value.is_prototype = True
+            #objects inheriting from this one may now find fields elsewhere
+            if self.is_prototype:
+                self.inter_instance.proto_epoch += 1
         else:
-            self.inter_instance.do_assignment(self.fields, field_name, value)
+            idx = self.shape.field_index.get(field_name)
+            if idx is not None:
+                self.values[idx] = value
+            else:
+                self.shape = self.shape.with_field(field_name)
+                self.values.append(value)
+                #the new field hides fields of the same name further up the chain
+                if self.is_prototype:
+                    self.inter_instance.proto_epoch += 1
+
+    #copies are made lazily: the copy only copies the fields and prototype of its source (one
+    #level, so nested objects are lazy copies too) once it is used, or once any object or
+    #closure is about to change. until then the source can't have changed, so the copy sees
+    #the same values a full copy would have. the interpreter is shared, not copied
+    def __deepcopy__(self, memo):
+        copied = Object(self.inter_instance)
+        memo[id(self)] = copied
+        copied.source = self
+        copied.copy_memo = memo
+        #the copy can only keep a memo that doesn't keep the copy alive (see copy_value)
+        if type(memo) is not CopyMemo:
+            copied.finish_copy()
+            return copied
+        lazy_copies = self.inter_instance.lazy_copies
+        lazy_copies.add(weakref.ref(copied, lazy_copies.discard))
+        return copied
+
+    #copies fields and prototype over from the source if this is a lazy copy
+    def finish_copy(self):
+        source = self.source
+        if source is None:
+            return
+        source.finish_copy()
+        memo = self.copy_memo
+        self.shape = source.shape
+        self.values = [copy.deepcopy(value, memo) for value in source.values]
+        self.parent = copy.deepcopy(source.parent, memo)
+        if self.parent is not None:
+            self.parent.is_prototype = True
+        self.source = None
+        self.copy_memo = None
 
     def __str__(self):
-        return "fields " + str(self.fields) + " parent " + str(self.parent)
-        
-            
-        
-    
+        self.finish_copy()
+        fields = {field_name: [value] for field_name, value in zip(self.shape.field_names, self.values)}
+        return "fields " + str(fields) + " parent " + str(self.parent)
+
+#deepcopy memo that only weakly holds the objects and lambdas it copies to. lazy copies keep
+#the memo until they are made, so with a plain dict a copy that's never read would keep
+#itself alive through it, and still get copied by the next finish_lazy_copies
+class CopyMemo(dict):
+    __slots__ = ()
+
+    def __setitem__(self, key, value):
+        if type(value) is Object or type(value) is Lambda:
+            value = weakref.ref(value)
+        dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        value = dict.get(self, key, default)
+        if type(value) is weakref.ref:
+            value = value()
+            if value is None:
+                return default
+        return value
+
+#deep copies a lambda or object that is passed or returned by value
+def copy_value(value):
+    return copy.deepcopy(value, CopyMemo())
+
+
+#(operator, type of op1, type of op2) -> function of the two operand values
+#pairs that aren't in the table are a type error
+def build_binary_operator_table():
+    value_types = (int, bool, str, type(None), Object, Function, Lambda)
+    comparisons = {'<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+    arithmetic = {'-': operator.sub, '*': operator.mul, '/': operator.floordiv}
+    table = {}
+    for type1 in value_types:
+        for type2 in value_types:
+            int1 = issubclass(type1, int) #bools count as ints
+            int2 = issubclass(type2, int)
+            #'+' works on anything but nil, functions and lambdas, as long as the types
+            #match or one is an int (python raises if they still can't be added)
+            if (type1 == type2 or int1 or int2) and type1 not in (type(None), Function, Lambda):
+                table[('+', type1, type2)] = operator.add
+            #'-', '*' and '/' only work on ints
+            if int1:
+                for op, func in arithmetic.items():
+                    table[(op, type1, type2)] = func
+            #comparisons only work on ints, not bools
+            if type1 is int and type2 is not bool:
+                for op, func in comparisons.items():
+                    table[(op, type1, type2)] = func
+            #'==' and '!=' compare ints as bools when the other side is a bool,
+            #and are false/true for different types unless one is an int
+            if int1 and int2 and (type1 is bool or type2 is bool):
+                table[('==', type1, type2)] = lambda op1, op2: bool(op1) == bool(op2)
+                table[('!=', type1, type2)] = lambda op1, op2: bool(op1) != bool(op2)
+            elif type1 != type2 and not int1 and not int2:
+                table[('==', type1, type2)] = lambda op1, op2: False
+                table[('!=', type1, type2)] = lambda op1, op2: True
+            else:
+                table[('==', type1, type2)] = operator.eq
+                table[('!=', type1, type2)] = operator.ne
+            #'||' and '&&' need op1 to be an int, which is false if it is 0, true otherwise
+            if int1 and int2:
+                table[('||', type1, type2)] = lambda op1, op2: bool(op1) or bool(op2)
+                table[('&&', type1, type2)] = lambda op1, op2: bool(op1) and bool(op2)
+            elif int1:
+                table[('||', type1, type2)] = lambda op1, op2: bool(op1) or op2
+                table[('&&', type1, type2)] = lambda op1, op2: bool(op1) and op2
+    return table
+
+BINARY_OPERATOR_TABLE = build_binary_operator_table()
+
+
 class Interpreter(InterpreterBase):
-    def __init__(self, console_output=True, inp=None, trace_output=False):
+    def __init__(self, console_output=True, inp=None, trace_output=False, engine="tree",
+                 short_circuit=False, max_call_depth=100000):
         super().__init__(console_output, inp)   # call InterpreterBase's constructor
+        self.engine = engine #"tree" walks the AST directly, "bytecode" and "closure" compile it first
+        self.short_circuit = short_circuit #skip op2 of '&&'/'||' when op1 decides the result,
+            #off by default so both operands are always evaluated
+        self.max_call_depth = max_call_depth #most nested calls the bytecode engine keeps on its own
+            #call stack (the other engines recurse in python and hit its recursion limit first)
     
     def run(self, program):
         ast = parse_program(program)         # parse program into AST
-        self.variable_name_to_value = {}  # dict to hold var name as key and stack for values
+        ConstantFolder(self).fold_program(ast) # precompute operators on literals
+        num_slots = SlotResolver().resolve_program(ast) # give each variable name a slot
+        BlockVarAnalyzer().analyze_program(ast) # find the variables each block may create
+        TailCallAnalyzer().analyze_program(ast) # find the functions tail calls can jump to
+        FreeVariableAnalyzer().analyze_program(ast) # find the variables each lambda captures
+        self.variable_slots = [[] for _ in range(num_slots)]  # stack of values for each variable slot
         self.function_and_arg_counts = defaultdict(dict) # dict of dicts to hold each function, 
                                     #and nested dicts for arg counts (for overloading)
-        self.is_returning = False #return flag set to true if current returning out of blocks
-        self.return_value = None #return value
-        self.child_object = [] #current object scope if we're in a method
+        self.function_values = {} #function name -> its Function, or None if the name is overloaded
+        self.child_object = [] #(variable slot, object) for current object scope if we're in a method
         self.inside_method = False #set to true when a method is called
+        self.empty_shape = Shape(()) #shape of new objects, root of every other shape
+        self.proto_epoch = 0 #bumped whenever a prototype gets a new field or proto, which
+            #invalidates every object's lookup_cache
+        self.lazy_copies = set() #weak references to copied objects that haven't copied their source yet
+        self.closure_cells = [] #closure_vars of the running lambdas that use cells instead of stacks
+        self.running_lambdas = [] #Lambdas being run, innermost last
+        self.register_node_handlers()
 
         main_func = self.evaluate_func_definitions(ast)
+        self.install_engine(ast)
 
         #print(ast)
        
         #if there exists a main function
         if main_func:
-            self.run_function(self.variable_name_to_value, main_func, [])
+            self.run_function(main_func, [])
         else: #throw error since no main
             super().error(
                 ErrorType.NAME_ERROR,
                 "No main() function was found",
             )
 
+    #node type -> bound handler taking the node, looked up once per statement/expression
+    #engines can add or replace entries to specialize nodes
+    def register_node_handlers(self):
+        self.statement_handlers = {
+            '=': self.run_assignment,
+            InterpreterBase.FCALL_DEF: self.do_func_call,
+            InterpreterBase.MCALL_DEF: self.evaluate_method_call,
+            InterpreterBase.IF_DEF: self.evaluate_if_statement,
+            InterpreterBase.WHILE_DEF: self.evaluate_while_statement,
+            InterpreterBase.RETURN_DEF: self.run_return,
+        }
+        self.expression_handlers = {
+            InterpreterBase.FCALL_DEF: self.do_func_call,
+            InterpreterBase.NEG_DEF: self.evaluate_unary_op,
+            InterpreterBase.NOT_DEF: self.evaluate_unary_op,
+            InterpreterBase.VAR_DEF: self.evaluate_variable,
+            InterpreterBase.INT_DEF: self.evaluate_value,
+            InterpreterBase.STRING_DEF: self.evaluate_value,
+            InterpreterBase.BOOL_DEF: self.evaluate_value,
+            InterpreterBase.NIL_DEF: self.evaluate_value,
+            InterpreterBase.LAMBDA_DEF: self.evaluate_lambda,
+            InterpreterBase.MCALL_DEF: self.evaluate_method_call,
+            InterpreterBase.OBJ_DEF: self.create_object,
+        }
+        for op in BINARY_OPERATORS:
+            self.expression_handlers[op] = self.evaluate_binary_operator
+        if self.short_circuit:
+            self.expression_handlers['&&'] = self.evaluate_short_circuit_operator
+            self.expression_handlers['||'] = self.evaluate_short_circuit_operator
+
+    #swap in the compiled engine's block and expression runners if one was requested
+    def install_engine(self, ast):
+        if self.engine == "tree":
+            return
+        if self.engine == "bytecode":
+            from brewvm import BytecodeEngine
+            BytecodeEngine(self).install(ast)
+        elif self.engine == "closure":
+            from brewclosure import ClosureEngine
+            ClosureEngine(self).install(ast)
+        else:
+            raise ValueError(f"Unknown engine {self.engine}")
+
     def throw_unknown_lambda_error(self, num_args):
         super().error(ErrorType.NAME_ERROR,
                 f"Unknown lambda with with arg length {num_args}")
@@ -198,15 +451,29 @@ class Interpreter(InterpreterBase):
         super().error(ErrorType.TYPE_ERROR,
                     f"Assigning invalid type as prototype")
         
-    #returns var_name if var isn't a reference, otherwise returns
-    #referenced variable and idx of its stack that contains referenced value
-    def get_referenced_variable(self, scope_var_list, var_name):
-        if type(scope_var_list[var_name][-1]) is tuple:
-            ref_var = scope_var_list[var_name][-1][1]
-            idx = scope_var_list[var_name][-1][0]
-            return ref_var, idx
+    #returns the value of the variable's current binding (top of its stack)
+    def get_variable(self, var_slot):
+        value = self.variable_slots[var_slot][-1]
+        if type(value) is Cell:
+            return value.value
+        return value
+
+    #reassigns the variable's current binding, and so whatever refers to it
+    def set_variable(self, var_slot, value):
+        var_stack = self.variable_slots[var_slot]
+        if type(var_stack[-1]) is Cell:
+            var_stack[-1].value = value
         else:
-            return var_name, -1
+            var_stack[-1] = value
+
+    #returns the Cell of the variable's current binding, moving its value into one if needed
+    def get_variable_cell(self, var_slot):
+        var_stack = self.variable_slots[var_slot]
+        cell = var_stack[-1]
+        if type(cell) is not Cell:
+            cell = Cell(cell)
+            var_stack[-1] = cell
+        return cell
         
     #iterate through all func definition nodes and store Function objects into function_and_arg_counts
     #return main Function object if it exists
@@ -220,74 +487,104 @@ class Interpreter(InterpreterBase):
             if name == "main":
                 main_func = self.function_and_arg_counts[name][num_args]
 
+        #value of each function name used as a variable (overloaded names can't be)
+        for name, overloads in self.function_and_arg_counts.items():
+            if len(overloads) > 1:
+                self.function_values[name] = None
+            else:
+                self.function_values[name] = next(iter(overloads.values()))
+
         return main_func
 
     #run statement nodes (either assignment, function call, if, while, or return)
+    #returns a Return record if the statement returns (calls return their value, which is
+    #thrown away)
     def run_statement(self, statement_node):
-        #print(str(self.variable_name_to_value))
-        if statement_node.elem_type == '=':
-            target_var_name, resulting_value = self.evaluate_assignment_node(statement_node)
-            self.do_assignment(self.variable_name_to_value, target_var_name, resulting_value)
-        elif statement_node.elem_type == 'fcall':
-            self.do_func_call(self.variable_name_to_value, statement_node)
-        #if expression is method call
-        elif statement_node.elem_type == 'mcall':
-            self.evaluate_method_call(self.variable_name_to_value, statement_node)
-        elif statement_node.elem_type == 'if':
-            self.evaluate_if_statement(self.variable_name_to_value, statement_node)
-        elif statement_node.elem_type == 'while':
-            self.evaluate_while_statement(self.variable_name_to_value, statement_node)
-        elif statement_node.elem_type == 'return':
-            return_value = self.evaluate_return_statement(statement_node)
-            self.is_returning = True #set to true since we are returning
-            self.return_value = return_value #store value to be returned
-
-    def evaluate_assignment_node(self, statement_node):
-        target_var_name = statement_node.get("name")
-        source_node = statement_node.get("expression")
-        resulting_value = self.evaluate_expression(source_node)
-        return target_var_name, resulting_value
-
-    def do_assignment(self, scope_var_list, target_var_name, resulting_value):
-        #if variable is accesssing field of object
-        if '.' in target_var_name:
-            object_name = target_var_name[0:target_var_name.index('.')]
-            field_name = target_var_name[target_var_name.index('.') + 1:]
-            
-            object = self.get_object(object_name)
+        handler = self.statement_handlers.get(statement_node.elem_type)
+        #any other expression used as a statement is ignored
+        if handler is not None:
+            return handler(statement_node)
+        return None
+
+    def run_assignment(self, assign_node):
+        resulting_value = self.evaluate_expression(assign_node.expression)
+        self.do_assignment(assign_node, resulting_value)
+
+    def run_return(self, return_node):
+        expression = return_node.expression
+        if expression is None:
+            return Return(None)
+        if return_node.tail_call:
+            return Return(self.copy_return_value(self.evaluate_tail_call(return_node)))
+        return Return(self.copy_return_value(self.evaluate_expression(expression)))
+
+    #assigns resulting_value to the target of assignment node assign_node
+    def do_assignment(self, assign_node, resulting_value):
+        target_var_name = assign_node.name
+        #if variable is accessing field of object (SlotResolver already split the name)
+        if assign_node.field_name is not None:
+            object = self.get_object(assign_node.object_name, assign_node.object_slot, assign_node.cell)
                 
-            object.assign_field(field_name, resulting_value, self)
+            object.assign_field(assign_node.field_name, resulting_value, self)
+        #if variable is a closure var of the running lambda
+        elif assign_node.cell and assign_node.slot in self.closure_cells[-1]:
+            self.write_cell(assign_node.slot, resulting_value)
         #if variable is 'this'
         elif target_var_name == "this":
-            ref_var, idx = self.get_referenced_variable(scope_var_list, self.child_object[-1][0])
             #throw error if resulting value is not an object
             # if not isinstance(resulting_value, Object) and resulting_value != None:
             #     super().error(ErrorType.TYPE_ERROR,
             #             f"Cannot assign non-object to 'this'")
-            self.child_object[-1] = (self.child_object[-1][0], resulting_value)
-            scope_var_list[ref_var][idx] = resulting_value
+            object_slot = self.child_object[-1][0]
+            self.child_object[-1] = (object_slot, resulting_value)
+            #methods called as this.m() have no variable of their own to rebind
+            if object_slot is not None:
+                self.set_variable(object_slot, resulting_value)
         #if variable hasn't been created before or has gone out of scope
-        elif (target_var_name not in scope_var_list or 
-                len(scope_var_list[target_var_name]) == 0):
-            scope_var_list[target_var_name] = [resulting_value]
+        elif len(self.variable_slots[assign_node.slot]) == 0:
+            self.variable_slots[assign_node.slot].append(resulting_value)
         #if variable exists, reassign existing local var (top of stack)
-        elif len(scope_var_list[target_var_name]) > 0:
-            ref_var, idx = self.get_referenced_variable(scope_var_list, target_var_name)
-            scope_var_list[ref_var][idx] = resulting_value
+        else:
+            self.set_variable(assign_node.slot, resulting_value)
 
-    #takes in list of local vars and pops the last value assigned to each variable
-    def clean_scope(self, scope_var_list, local_vars):
+    #takes in slots of local vars and pops the last value assigned to each variable
+    #(a variable with an empty stack is out of scope)
+    def clean_scope(self, local_vars):
+        variable_slots = self.variable_slots
         for local_var in local_vars:
-            scope_var_list[local_var].pop()
-            #if variable has no assigned value, delete it
-            if len(scope_var_list[local_var]) == 0:
-                del scope_var_list[local_var]
-
-    def evaluate_if_statement(self, scope_var_list, if_node):
-        local_vars = set() #stores variables that will go out of scope when if statement ends
-        condition = if_node.get('condition')
-        true_statements = if_node.get('statements')
-        false_statements = if_node.get('else_statements')
+            variable_slots[local_var].pop()
+
+    #takes in the precomputed new_vars of a block when the block starts and returns
+    #the slots that aren't in scope yet, which are the variables the block creates
+    def get_new_block_vars(self, new_vars):
+        if not new_vars:
+            return new_vars
+        variable_slots = self.variable_slots
+        return [var_slot for var_slot in new_vars if not variable_slots[var_slot]]
+
+    #takes in the result of get_new_block_vars once the block is over and pops the ones
+    #that were actually assigned
+    def clean_block_scope(self, new_block_vars):
+        variable_slots = self.variable_slots
+        for var_slot in new_block_vars:
+            if variable_slots[var_slot]:
+                variable_slots[var_slot].pop()
+
+    #runs statements in order
+    #returns the Return record of the return statement that was hit, or None if there wasn't one
+    #(caller is responsible for cleaning scope)
+    def run_block(self, statements):
+        for statement in statements:
+            completion = self.run_statement(statement)
+            #if we are returning
+            if type(completion) is Return:
+                return completion
+        return None
+
+    def evaluate_if_statement(self, if_node):
+        condition = if_node.condition
+        true_statements = if_node.statements
+        false_statements = if_node.else_statements
         result = self.evaluate_expression(condition)
       
         #check if result is boolean
@@ -295,217 +592,108 @@ class Interpreter(InterpreterBase):
             super().error(ErrorType.TYPE_ERROR,
                         f"condition does not evaluate to boolean")
         if result:
-            for statement in true_statements:
-                #if statement is assignment
-                if statement.elem_type == '=':
-                    var_name = statement.get('name')
-                    #if variable hasn't been created in scope yet, add to local_vars and variable is not a field
-                    if var_name not in scope_var_list and '.' not in var_name and var_name != 'this':
-                        local_vars.add(var_name)
-                    self.run_statement(statement)
-                else:
-                    self.run_statement(statement)
-                    #if we are returning
-                    if self.is_returning:
-                        self.clean_scope(self.variable_name_to_value, local_vars)
-                        return self.return_value
+            statements = true_statements
+            new_vars = if_node.new_vars
         else:
             if false_statements is None:
-                return
-            for statement in false_statements:
-                #check if statement is assignment
-                if statement.elem_type == '=':
-                    var_name = statement.get('name')
-                    if var_name not in scope_var_list and '.' not in var_name and var_name != 'this':
-                        local_vars.add(var_name)
-                    self.run_statement(statement)
-                else:
-                    self.run_statement(statement)
-                    if self.is_returning:
-                        self.clean_scope(self.variable_name_to_value, local_vars)
-                        return self.return_value
-        #clean scope since we are returning
-        self.clean_scope(self.variable_name_to_value, local_vars)
-
-    def evaluate_while_statement(self, scope_var_list, while_node):
-        local_vars = set() 
-        condition = while_node.get('condition')
-        statements = while_node.get('statements')
-
-        #check if condition is boolean expression
-        if not isinstance(self.evaluate_expression(condition), int):
-            super().error(ErrorType.TYPE_ERROR,
-                        f"condition does not evaluate to boolean")
-            
-        while(self.evaluate_expression(condition)):
-            for statement in statements:
-                #check if statement is assignment
-                if statement.elem_type == '=':
-                    var_name = statement.get('name')
-                    if var_name not in scope_var_list and '.' not in var_name and var_name != 'this':
-                        local_vars.add(var_name)
-                    self.run_statement(statement)
-                else:
-                    self.run_statement(statement)
-                    if self.is_returning:
-                        self.clean_scope(self.variable_name_to_value, local_vars)
-                        return self.return_value
-                    
-            #continue checking if condition is boolean
-            if not isinstance(self.evaluate_expression(condition), int):
+                return None
+            statements = false_statements
+            new_vars = if_node.else_new_vars
+        local_vars = self.get_new_block_vars(new_vars) #variables that will go out of scope when if statement ends
+        completion = self.run_block(statements)
+        #clean scope since the block is over (or we are returning)
+        self.clean_block_scope(local_vars)
+        return completion
+
+    def evaluate_while_statement(self, while_node):
+        local_vars = self.get_new_block_vars(while_node.new_vars)
+        condition = while_node.condition
+        statements = while_node.statements
+
+        #condition is evaluated once per iteration
+        while True:
+            result = self.evaluate_expression(condition)
+            #check if condition is boolean expression
+            if not isinstance(result, int):
                 super().error(ErrorType.TYPE_ERROR,
                             f"condition does not evaluate to boolean")
-        self.clean_scope(self.variable_name_to_value, local_vars)
+            if not result:
+                break
+            completion = self.run_block(statements)
+            if completion is not None:
+                self.clean_block_scope(local_vars)
+                return completion
+        self.clean_block_scope(local_vars)
+        return None
 
-    def evaluate_return_statement(self, return_node):
-        expression = return_node.get('expression')
-        if expression is None:
-            return None
-        evaluated_expression = self.evaluate_expression(expression)
-      
+    #functions, lambdas and objects are returned by value
+    def copy_return_value(self, evaluated_expression):
         #if expression is function, return deep copy
         if isinstance(evaluated_expression, Function):
-            return Function(evaluated_expression.function_node)
+            return evaluated_expression.copy()
         #if expression is lambda, return deep copy
-        elif isinstance(evaluated_expression, Lambda):
-            return Lambda(evaluated_expression.lambda_node, copy.deepcopy(evaluated_expression.closure_vars), self)
-        elif isinstance(evaluated_expression, Object):
-            return copy.deepcopy(evaluated_expression)
+        elif isinstance(evaluated_expression, Lambda) or isinstance(evaluated_expression, Object):
+            return copy_value(evaluated_expression)
 
         return evaluated_expression
     
     def evaluate_expression(self, expression_node):
-        #if expression is function call
-        if expression_node.elem_type == 'fcall':
-            return self.do_func_call(self.variable_name_to_value, expression_node)
-        #if expression is unary operator
-        elif expression_node.elem_type == 'neg' or expression_node.elem_type == '!':
-            return self.evaluate_unary_op(expression_node)
-        #if expression is variable
-        elif expression_node.elem_type == 'var':
-            return self.evaluate_variable(self.variable_name_to_value, expression_node)
-        #if expression is value
-        elif (expression_node.elem_type == 'int' or expression_node.elem_type == 'string' or
-            expression_node.elem_type == 'bool' or expression_node.elem_type == 'nil'):
-            return self.evaluate_value(expression_node)
-        #if expression is lambda expression
-        elif expression_node.elem_type == 'lambda':
-            return self.evaluate_lambda(self.variable_name_to_value, expression_node)
-        #if expression is method call
-        elif expression_node.elem_type == 'mcall':
-            return self.evaluate_method_call(self.variable_name_to_value, expression_node)
-        #if expression is object instantiation
-        elif expression_node.elem_type == '@':
-            return Object(self)
-        #if expression is binary operator
-        else:
-            return self.evaluate_binary_operator(expression_node)
+        return self.expression_handlers[expression_node.elem_type](expression_node)
+
+    #obj_node isn't needed, it's only there so this can be the node handler of '@'
+    def create_object(self, obj_node=None):
+        return Object(self)
 
     def evaluate_binary_operator(self, binary_expression):
-        op1 = binary_expression.get('op1')
-        op2 = binary_expression.get('op2')
+        op1 = binary_expression.op1
+        op2 = binary_expression.op2
         
         #evaluate opt1
         op1_value = self.evaluate_expression(op1)
         #evaluate op2
         op2_value = self.evaluate_expression(op2)
- 
+
+        return self.apply_binary_operator(binary_expression.elem_type, op1_value, op2_value)
+
+    #'&&' or '||' that only evaluates op2 if op1 doesn't decide the result
+    def evaluate_short_circuit_operator(self, binary_expression):
         op = binary_expression.elem_type
+        op1_value = self.evaluate_expression(binary_expression.op1)
+        if self.short_circuits(op, op1_value):
+            return op == '||'
+        op2_value = self.evaluate_expression(binary_expression.op2)
+        return self.apply_binary_operator(op, op1_value, op2_value)
 
-        #throw error if operands are different types and op is not '==' or '!='
-        if (type(op1_value) != type(op2_value) and op != '==' and op != '!=' and  
-            not isinstance(op1_value, int) and not isinstance(op2_value, int)):
+    #True if op1_value alone decides '&&'/'||' (true for '||', false for '&&'), in which case
+    #the result is the same whatever op2 is
+    def short_circuits(self, op, op1_value):
+        if not isinstance(op1_value, int):
+            return False
+        if op == '||':
+            return bool(op1_value)
+        return not op1_value
+
+    #applies binary operator op to already evaluated operands
+    def apply_binary_operator(self, op, op1_value, op2_value):
+        func = BINARY_OPERATOR_TABLE.get((op, type(op1_value), type(op2_value)))
+        #throw error because wrong types
+        if func is None:
             super().error(
                 ErrorType.TYPE_ERROR,
                 "Incompatible types for operation",
             )
-
-        match op:
-            case '+':
-                #'+' only works on ints and strings
-                if (op1_value is not None and not isinstance(op1_value, Function)
-                    and not isinstance(op1_value, Lambda)):
-                    return op1_value + op2_value
-            case '-':
-                #'-' only works in ints
-                if isinstance(op1_value, int):
-                    return op1_value - op2_value
-            case '*':
-                #'*' only works in ints
-                if isinstance(op1_value, int):
-                    return op1_value * op2_value
-            case '/':
-                #'/' only works in ints
-                if isinstance(op1_value, int):
-                    return op1_value // op2_value
-            case '==':
-                #'==' returns false if different types
-                if (type(op1_value) != type(op2_value) and not isinstance(op1_value, int) 
-                    and not isinstance(op2_value, int)):
-                    return False
-                #int is false if it is 0, otherwise true
-                if(isinstance(op1_value, int) and isinstance(op2_value, bool)):
-                    op1_value = False if (op1_value == 0) else True 
-                if(isinstance(op2_value, int) and isinstance(op1_value, bool)):
-                    op2_value = False if (op2_value == 0) else True 
-                return op1_value == op2_value
-            case '!=':
-                #'!=' returns true if different types
-                if (type(op1_value) != type(op2_value) and not isinstance(op1_value, int) 
-                    and not isinstance(op2_value, int)):
-                    return True
-                #int is false if it is 0, otherwise true
-                if(isinstance(op1_value, int) and isinstance(op2_value, bool)):
-                    op1_value = False if (op1_value == 0) else True 
-                if(isinstance(op2_value, int) and isinstance(op1_value, bool)):
-                    op2_value = False if (op2_value == 0) else True 
-                return op1_value != op2_value
-            case '<':
-                #'<' only works in ints
-                if not isinstance(op1_value, bool) and not isinstance(op2_value, bool) and isinstance(op1_value, int):
-                    return op1_value < op2_value
-            case '<=':
-                #'<=' only works in ints
-                if not isinstance(op1_value, bool) and not isinstance(op2_value, bool) and isinstance(op1_value, int):
-                    return op1_value <= op2_value
-            case '>':
-                #'>' only works in ints
-                if not isinstance(op1_value, bool) and not isinstance(op2_value, bool) and isinstance(op1_value, int):
-                    return op1_value > op2_value
-            case '>=':
-                #'>=' only works in ints
-                if not isinstance(op1_value, bool) and not isinstance(op2_value, bool) and isinstance(op1_value, int):
-                    return op1_value >= op2_value
-            case '||':
-                #int is false if it is 0, true otherwise
-                if(isinstance(op1_value, int)):
-                    op1_value = False if (op1_value == 0) else True 
-                if(isinstance(op2_value, int)):
-                    op2_value = False if (op2_value == 0) else True 
-                if isinstance(op1_value, bool):
-                    return op1_value or op2_value
-            case '&&':
-                #int is false if it is 0, true otherwise
-                if(isinstance(op1_value, int)):
-                    op1_value = False if (op1_value == 0) else True 
-                if(isinstance(op2_value, int)):
-                    op2_value = False if (op2_value == 0) else True 
-                if isinstance(op1_value, bool):
-                    return op1_value and op2_value
-
-        #throw error because wrong types
-        super().error(
-            ErrorType.TYPE_ERROR,
-            "Incompatible types for operation",
-        )
+        return func(op1_value, op2_value)
 
     def evaluate_unary_op(self, unary_node):
-        op1 = unary_node.get('op1')
+        op1 = unary_node.op1
         op1_value = self.evaluate_expression(op1)
-            
-        if unary_node.elem_type == '!' and isinstance(op1_value, int):
+        return self.apply_unary_operator(unary_node.elem_type, op1_value)
+
+    #applies unary operator op ('!' or 'neg') to an already evaluated operand
+    def apply_unary_operator(self, op, op1_value):
+        if op == '!' and isinstance(op1_value, int):
             return not op1_value
-        elif unary_node.elem_type == 'neg' and isinstance(op1_value, int) and not isinstance(op1_value, bool):
+        elif op == 'neg' and isinstance(op1_value, int) and not isinstance(op1_value, bool):
             return -1*op1_value
         
         #wrong types for unary op
@@ -514,64 +702,95 @@ class Interpreter(InterpreterBase):
                 "Incompatible type for unary operation",
             )
 
-    #creates Lambda object that captures current scope
-    def evaluate_lambda(self, scope_var_list, lambda_node):
-        current_scope = {}
-        for var, value in scope_var_list.items():
-            ref_var, idx = self.get_referenced_variable(self.variable_name_to_value, var)
-            value = scope_var_list[ref_var][idx]
+    #creates Lambda object that captures current scope (just the variables it uses, if known)
+    def evaluate_lambda(self, lambda_node):
+        variable_slots = self.variable_slots
+        current_scope = {} #variable slot -> captured value
+        captured_slots = lambda_node.free_slots
+        if captured_slots is None:
+            captured_slots = range(len(variable_slots))
+        for var in captured_slots:
+            #skip variables that are out of scope
+            if not variable_slots[var]:
+                continue
+            value = self.get_variable(var)
             if not isinstance(value, Object) and not isinstance(value, Lambda):
                 current_scope[var] = copy.deepcopy(value)
             else:
-                if idx == -1:
-                    current_scope[var] = (len(scope_var_list[ref_var]) - 1, ref_var)
-                else:
-                    current_scope[var] = (idx, ref_var)
+                #objects and lambdas are captured by reference to the variable
+                current_scope[var] = self.get_variable_cell(var)
 
         new_lambda = Lambda(lambda_node, current_scope, self)
 
         return new_lambda
 
-    def evaluate_variable(self, scope_var_list, variable_node):
-        var_name = variable_node.get('name')
-
-        #if variable is accessing field of object
-        if '.' in var_name:
-            object_name = var_name[0:var_name.index('.')]
-            field_name = var_name[var_name.index('.') + 1:]
+    def evaluate_variable(self, variable_node):
+        variable_slots = self.variable_slots
+        var_name = variable_node.name
 
-            object = self.get_object(object_name)
+        #if variable is accessing field of object (SlotResolver already split the name)
+        if variable_node.field_name is not None:
+            object = self.get_object(variable_node.object_name, variable_node.object_slot, variable_node.cell)
                 
-            return object.get_field(field_name)
+            return object.get_field(variable_node.field_name)
+        #if variable is a closure var of the running lambda
+        elif variable_node.cell and variable_node.slot in self.closure_cells[-1]:
+            return self.read_cell(variable_node.slot)
         #if variable is 'this'
         elif var_name == "this":
-            ref_var, idx = self.get_referenced_variable(scope_var_list, self.child_object[-1][0])
             #throw error if resulting value is not an object
             # if not isinstance(resulting_value, Object) and resulting_value != None:
             #     super().error(ErrorType.TYPE_ERROR,
             #             f"Cannot assign non-object to 'this'")
             return self.child_object[-1][1]
-        #if variable exists in dictionary with a stack of at least size 1
-        elif var_name in scope_var_list:
-            ref_var, idx = self.get_referenced_variable(self.variable_name_to_value, var_name)
-            return scope_var_list[ref_var][idx]
+        #if variable exists with a stack of at least size 1
+        elif variable_slots[variable_node.slot]:
+            return self.get_variable(variable_node.slot)
         #if variable exists as a function name
-        elif var_name in self.function_and_arg_counts:
+        elif var_name in self.function_values:
+            function = self.function_values[var_name]
             #if function is an overloaded function, throw error
-            if len(self.function_and_arg_counts[var_name]) > 1:
+            if function is None:
                 super().error(ErrorType.NAME_ERROR,
                         f"Cannot use overloaded function as a variable",)
             #return Function object corresponding to variable name
-            else:
-                return list(self.function_and_arg_counts[var_name].values())[0]
+            return function
         else:
             super().error(ErrorType.NAME_ERROR,
                         f"Variable {var_name} has not been defined",)
     
+    #turns every lazy object copy (see Object.__deepcopy__) into a full copy
+    #called before changing anything a lazy copy could still copy from
+    def finish_lazy_copies(self):
+        lazy_copies = self.lazy_copies
+        while lazy_copies:
+            lazy_copy = lazy_copies.pop()()
+            if lazy_copy is not None:
+                lazy_copy.finish_copy()
+
+    #reads closure var slot of the running lambda (captured objects and lambdas may be references)
+    def read_cell(self, var_slot):
+        value = self.closure_cells[-1][var_slot]
+        if type(value) is Cell:
+            return value.value
+        return value
+
+    def write_cell(self, var_slot, value):
+        if self.lazy_copies:
+            self.finish_lazy_copies()
+        cells = self.closure_cells[-1]
+        ref = cells[var_slot]
+        if type(ref) is Cell:
+            ref.value = value
+        else:
+            cells[var_slot] = value
+
     def evaluate_value(self, value_node):
-        return value_node.get('val')
+        return value_node.val
     
-    def get_object(self, object_name):
+    #object_slot is the slot of variable object_name (None for 'this')
+    #cell is True if object_name may be a closure var of the running lambda
+    def get_object(self, object_name, object_slot, cell=False):
         #if 'this' keyword is used
         if object_name == 'this':
             #if no object has been defined (aka we're not in a method), throw error
@@ -584,42 +803,33 @@ class Interpreter(InterpreterBase):
 
             return self.child_object[-1][1]
         
+        if cell and object_slot in self.closure_cells[-1]:
+            object = self.read_cell(object_slot)
+            if not isinstance(object, Object):
+                super().error(ErrorType.TYPE_ERROR,
+                    f"{object_name} is not an object")
+            return object
+
         #if object has not been created, throw error
-        if object_name not in self.variable_name_to_value:
+        if not self.variable_slots[object_slot]:
             super().error(ErrorType.NAME_ERROR,
                 f"Object {object_name} not found")
             
-        ref_var, idx = self.get_referenced_variable(self.variable_name_to_value, object_name)
+        object = self.get_variable(object_slot)
         #if object_name is not of type object
-        if not isinstance(self.variable_name_to_value[ref_var][idx], Object):
+        if not isinstance(object, Object):
             super().error(ErrorType.TYPE_ERROR,
                 f"{object_name} is not an object")
             
-        return self.variable_name_to_value[ref_var][idx]
+        return object
             
-    def evaluate_method_call(self, scope_var_list, method_node):
-        object_name = method_node.get('objref')
-        method_name = method_node.get('name')
-        args = method_node.get('args')
-
-        object = self.get_object(object_name)
-        method = object.get_field(method_name)
-
-        #if method_name is not of type lambda or function
-        if not isinstance(method, Lambda) and not isinstance(method, Function):
-            super().error(ErrorType.TYPE_ERROR,
-                    f"{method_name} is not a method")
-            
-        self.child_object.append((object_name, object))
+    def evaluate_method_call(self, method_node):
+        args = method_node.args
+        method = self.resolve_method_call(method_node)
 
         #if method refers to a function
         if isinstance(method, Function):
-            #run function if number of inputs matches number of args
-            if len(args) == method.num_args:
-                ans = self.run_function(self.variable_name_to_value, method, args)
-            else:
-                super().error(ErrorType.NAME_ERROR,
-                f"Unknown function {method_name} with arg length {len(args)}")
+            ans = self.run_function(method, args)
         #if method is a closure
         elif isinstance(method, Lambda):
                 #run lambda function
@@ -628,129 +838,292 @@ class Interpreter(InterpreterBase):
         self.child_object.pop()
         return ans
 
-    def do_func_call(self, scope_var_list, func_node):
-        func_to_be_called = func_node.get('name')
-        args = func_node.get('args')
+    #finds the Function or Lambda a method call runs and makes its object 'this'
+    #(caller pops child_object once the method returns)
+    def resolve_method_call(self, method_node):
+        object_name = method_node.objref
+        method_name = method_node.name
+        args = method_node.args
+
+        object = self.get_object(object_name, method_node.object_slot)
+        method = self.get_method(object, method_node)
+
+        #if method_name is not of type lambda or function
+        if not isinstance(method, Lambda) and not isinstance(method, Function):
+            super().error(ErrorType.TYPE_ERROR,
+                    f"{method_name} is not a method")
+            
+        self.child_object.append((method_node.object_slot, object))
+
+        #number of inputs must match number of args
+        if isinstance(method, Function) and len(args) != method.num_args:
+            super().error(ErrorType.NAME_ERROR,
+            f"Unknown function {method_name} with arg length {len(args)}")
+        if isinstance(method, Lambda) and len(args) != method.num_args:
+            self.throw_unknown_lambda_error(len(args))
+        return method
 
+    #gets the method field of object named by method_node, using the node's cache of where it
+    #found the method last time: (object's shape, object's proto, proto_epoch, object in the
+    #prototype chain that has the method or None for the object itself, index of the method)
+    def get_method(self, object, method_node):
+        cache = method_node.method_cache
+        if cache is not None and object.shape is cache[0] and object.source is None:
+            if cache[3] is None:
+                return object.values[cache[4]]
+            if object.parent is cache[1] and self.proto_epoch == cache[2]:
+                return cache[3].values[cache[4]]
+
+        method_name = method_node.name
+        method = object.get_field(method_name)
+        if method_name == 'proto':
+            return method
+        idx = object.shape.field_index.get(method_name)
+        if idx is not None:
+            method_node.method_cache = (object.shape, None, 0, None, idx)
+        else:
+            #get_field just found it through the object's lookup cache
+            holder, idx = object.lookup_cache[method_name]
+            method_node.method_cache = (object.shape, object.parent, self.proto_epoch, holder, idx)
+        return method
+
+    def do_func_call(self, func_node):
+        args = func_node.args
+        kind, target = self.get_call_target(func_node)
+
+        #top-level function with same num of args
+        if kind == 'function':
+            return self.run_function(target, args)
         #print function
-        if func_to_be_called == 'print':
+        elif kind == 'print':
             self.do_print(args)
             return None
         #inputi fuction
-        elif func_to_be_called == 'inputi':
+        elif kind == 'inputi':
             return self.do_inputi(args)
         #inputs function
-        elif func_to_be_called == 'inputs':
+        elif kind == 'inputs':
             return self.do_input(args)
+
+        target = self.resolve_call(func_node)
+        if isinstance(target, Function):
+            return self.run_function(target, args)
+        #run lambda function
+        return target.run_lambda(args, self)
+
+    #returns what the name of fcall node func_node refers to, as (kind, Function or None):
+    #'print', 'inputi' or 'inputs' for builtins, 'function' for a top-level function with the
+    #right number of args, 'unknown' for a top-level function without, otherwise 'variable'
+    #cached on the node, since top-level functions don't change while a program runs
+    def get_call_target(self, func_node):
+        cache = func_node.call_target
+        if cache is not None:
+            return cache
+        func_to_be_called = func_node.get('name')
+        target = None
+        if func_to_be_called == 'print' or func_to_be_called == 'inputi' or func_to_be_called == 'inputs':
+            kind = func_to_be_called
         #if function exists in function dict
         elif func_to_be_called in self.function_and_arg_counts:
             #if function exists with same num of args
-            if len(args) in self.function_and_arg_counts[func_to_be_called]:
-                return self.run_function(self.variable_name_to_value, self.function_and_arg_counts[func_to_be_called][len(args)], args)
+            target = self.function_and_arg_counts[func_to_be_called].get(len(func_node.get('args')))
+            kind = 'unknown' if target is None else 'function'
+        #variables are looked up on every call since their values change
+        else:
+            kind = 'variable'
+        func_node.call_target = (kind, target)
+        return func_node.call_target
+
+    #finds the Function or Lambda called by (non-builtin) fcall node func_node
+    def resolve_call(self, func_node):
+        func_to_be_called = func_node.get('name')
+        args = func_node.args
+        kind, target = self.get_call_target(func_node)
+
+        if kind == 'function':
+            return target
         #if it's a variable that stores a lambda or first-class function
-        elif func_to_be_called in scope_var_list:
-            ref_var, idx = self.get_referenced_variable(self.variable_name_to_value, func_to_be_called)
-            var_value = scope_var_list[ref_var][idx]
+        elif kind == 'variable' and self.variable_slots[func_node.slot]:
+            var_value = self.get_variable(func_node.slot)
             #throw type error if trying to call function through a variable that doesn't hold function
             if not isinstance(var_value, Function) and not isinstance(var_value, Lambda):
                 super().error(ErrorType.TYPE_ERROR,
                     f"Variable does not store function or lambda")
             elif isinstance(var_value, Function):
-                #run function if number of inputs matches number of args
+                #function if number of inputs matches number of args
                 if len(args) == var_value.num_args:
-                    return self.run_function(self.variable_name_to_value, var_value, args)
+                    return var_value
                 else:
                     super().error(ErrorType.TYPE_ERROR,
                     f"Unknown function {func_to_be_called} with arg length {len(args)}")
             elif isinstance(var_value, Lambda):
-                    #run lambda function
-                    return var_value.run_lambda(args,self)
+                if len(args) != var_value.num_args:
+                    self.throw_unknown_lambda_error(len(args))
+                return var_value
         #unknown function
         super().error(ErrorType.NAME_ERROR,
                     f"Unknown function {func_to_be_called} with arg length {len(args)}")
     
-    def run_function(self, scope_var_list, func_obj, input_args):
-        func_node = func_obj.function_node
-        local_vars = set() #local to function (not including inner blocks or func calls)
-        func_args = func_node.get('args')
-        func_statements = func_node.get('statements')
-
-        for i in range(len(func_args)):
-            arg = func_args[i]
-            arg_name = arg.get('name')
-            input_arg = input_args[i]
-            local_vars.add(arg_name) #add arg as local variable
-            #if arg variable has not been created before in dict
-            if arg_name not in scope_var_list:
-                scope_var_list[arg_name] = []
-            #pass var by reference
-            if arg.elem_type == 'refarg' and input_arg.elem_type == 'var':
-                #throw error if input is not defined
-                if (input_arg.get('name') not in scope_var_list 
-                    and input_arg.get('name') not in self.function_and_arg_counts):
-                    super().error(ErrorType.NAME_ERROR,
-                        f"Variable {input_arg.get('name')} has not been defined",)
-                #if input is a variable
-                elif input_arg.get('name') in scope_var_list:
-                    ref_var, idx = self.get_referenced_variable(self.variable_name_to_value, input_arg.get('name'))
-                    #if trying to reference a variable that is not a reference
-                    if idx == -1:
-                        idx = len(scope_var_list[input_arg.get('name')]) - 1
-                    #(idx of place in variable stack that is referred to, referred variable)
-                    scope_var_list[arg_name].append((idx, ref_var))
-                #if input is a function name
-                else:
-                    scope_var_list[arg_name].append(self.evaluate_variable(self.variable_name_to_value, input_arg))
+    #returns the Function or Lambda the 'return f(...)' of return_node can jump to after its
+    #caller has left, or None if it has to be called normally (resolved the same way as do_func_call)
+    def resolve_tail_call(self, return_node):
+        func_node = return_node.expression
+        num_args = len(func_node.get('args'))
+        kind, target = self.get_call_target(func_node)
+        if kind == 'variable' and self.variable_slots[func_node.slot]:
+            target = self.get_variable(func_node.slot)
+        if isinstance(target, Function):
+            target_node = target.function_node
+        elif isinstance(target, Lambda):
+            target_node = target.lambda_node
+        else:
+            return None
+        if len(target_node.get('args')) != num_args:
+            return None
+        if not self.can_replace_caller(target, target_node, return_node.returns_from):
+            return None
+        return target
+
+    #True if target (whose node is target_node) can run in place of the running function or
+    #lambda, whose node is caller_node (see TailCallAnalyzer)
+    def can_replace_caller(self, target, target_node, caller_node):
+        if not target_node.tail_callable:
+            return False
+        if not target_node.calls_variable:
+            return True
+        #has to be a call of itself: functions are the same function, lambdas the same closure too
+        if target_node is not caller_node:
+            return False
+        return isinstance(target, Function) or self.running_lambdas[-1] is target
+
+    #evaluates the call in 'return f(...)' of return_node; gives back a TailCall for the caller's
+    #run_function/run_lambda to run once the caller has been cleaned up, if possible
+    def evaluate_tail_call(self, return_node):
+        func_node = return_node.expression
+        target = self.resolve_tail_call(return_node)
+        if target is None:
+            return self.do_func_call(func_node)
+        is_function = isinstance(target, Function)
+        binding_plan = target.binding_plan
+        #bind each argument as it is evaluated, same as a normal call, then take them back
+        for (arg_slot, is_ref), input_arg in zip(binding_plan, func_node.args):
+            #functions get copies of lambdas and objects passed by value
+            self.bind_value(arg_slot, self.evaluate_expression(input_arg), is_function)
+        variable_slots = self.variable_slots
+        arg_values = [variable_slots[arg_slot].pop() for arg_slot, is_ref in reversed(binding_plan)]
+        arg_values.reverse()
+        return TailCall(target, arg_values)
+
+    #Return record for leaving the current function, asking run_function/run_lambda to call target next
+    def return_tail_call(self, target, arg_values):
+        return Return(TailCall(target, arg_values))
+
+    #keeps calling while the called function or lambda returns a TailCall
+    def run_tail_calls(self, return_value):
+        variable_slots = self.variable_slots
+        while type(return_value) is TailCall:
+            target = return_value.target
+            for (arg_slot, is_ref), arg_value in zip(target.binding_plan, return_value.arg_values):
+                variable_slots[arg_slot].append(arg_value)
+            if isinstance(target, Function):
+                return_value = self.run_function_body(target.function_node)
             else:
-            #add input value as new value in the stack corresponding to variable name
-                input_arg_value = self.evaluate_expression(input_args[i])
-                #if a Lambda is passed in by value, make a copy of it
-                if(isinstance(input_arg_value, Lambda)):
-                    input_arg_value = Lambda(input_arg_value.lambda_node, copy.deepcopy(input_arg_value.closure_vars), self)
-                if(isinstance(input_arg_value, Object)):
-                    input_arg_value = copy.deepcopy(input_arg_value)
-                scope_var_list[arg_name].append(input_arg_value)
-
-        for statement in func_statements:
-            #check if statement is assignment
-            if statement.elem_type == '=':
-                var_name = statement.get('name')
-                if var_name not in scope_var_list and '.' not in var_name and var_name != 'this':
-                    local_vars.add(var_name)
-                self.run_statement(statement)
+                return_value = target.run_lambda_body()
+        return return_value
+
+    #binds each input arg to its parameter in binding_plan ((slot, passed by ref) of each
+    #parameter of the function or lambda being called), evaluating them in order
+    #lambdas and objects passed by value are copied if copy_objects is set
+    def bind_arguments(self, binding_plan, input_args, copy_objects):
+        for (arg_slot, is_ref), input_arg in zip(binding_plan, input_args):
+            #pass var by reference
+            if is_ref and input_arg.elem_type == 'var':
+                self.bind_reference(arg_slot, input_arg)
             else:
-                self.run_statement(statement)
-                if self.is_returning:
-                    #clean scope because returning from function
-                    self.clean_scope(self.variable_name_to_value, local_vars)
-                    self.is_returning = False #set to false because we stop
-                        #returning once we return out of a function
-                    return self.return_value
-
-        self.clean_scope(self.variable_name_to_value, local_vars) 
-        self.is_returning = False
+                #add input value as new value in the stack corresponding to variable
+                self.bind_value(arg_slot, self.evaluate_expression(input_arg), copy_objects)
+
+    #binds var node input_arg by reference to the parameter in arg_slot
+    def bind_reference(self, arg_slot, input_arg):
+        variable_slots = self.variable_slots
+        input_slot = input_arg.slot
+        #throw error if input is not defined
+        if ((input_slot is None or not variable_slots[input_slot])
+            and input_arg.get('name') not in self.function_and_arg_counts):
+            self.throw_unknown_input_error(input_arg.get('name'))
+        #if input is a variable
+        elif input_slot is not None and variable_slots[input_slot]:
+            #parameter shares the input variable's binding
+            variable_slots[arg_slot].append(self.get_variable_cell(input_slot))
+        #if input is a function name
+        else:
+            variable_slots[arg_slot].append(self.evaluate_variable(input_arg))
+
+    def bind_value(self, arg_slot, input_arg_value, copy_objects):
+        if copy_objects:
+            #if a Lambda is passed in by value, make a copy of it
+            if(isinstance(input_arg_value, Lambda)):
+                input_arg_value = copy_value(input_arg_value)
+            if(isinstance(input_arg_value, Object)):
+                input_arg_value = copy_value(input_arg_value)
+        self.variable_slots[arg_slot].append(input_arg_value)
+
+    def run_function(self, func_obj, input_args):
+        self.bind_arguments(func_obj.binding_plan, input_args, True)
+
+        #same as run_function_body, run here so an ordinary call doesn't take another python frame
+        func_node = func_obj.function_node
+        local_vars = self.get_new_block_vars(func_node.new_vars)
+        completion = self.run_block(func_node.statements)
+        self.leave_function_scope(func_node, local_vars)
+        #we stop returning once we return out of the function
+        if completion is None:
+            return None
+        #'return f(...)' left the function so that f runs in its place
+        if type(completion.value) is TailCall:
+            return self.run_tail_calls(completion.value)
+        return completion.value
+
+    #runs a function once its parameters are bound, and unbinds them
+    #(for the calls run_tail_calls makes)
+    def run_function_body(self, func_node):
+        func_statements = func_node.statements
+
+        #variables local to function (not including inner blocks or func calls)
+        local_vars = self.get_new_block_vars(func_node.new_vars)
+        completion = self.run_block(func_statements)
+        self.leave_function_scope(func_node, local_vars)
+        #we stop returning once we return out of the function
+        if completion is not None:
+            return completion.value
         #return nil if no return statement in function
         return None       
 
+    #cleans scope because we are leaving the function
+    def leave_function_scope(self, func_node, local_vars):
+        self.clean_block_scope(local_vars)
+        self.clean_scope(func_node.param_slots)
+
     def do_print(self, args):
         print_string = ""
         #concatenate each argument for print() to output string
         for arg in args:
             arg_val = self.evaluate_expression(arg)
-            arg_val_print = "" #string form of arg to be printed
-            #if value is of type bool, convert to corresponding strings
-            if isinstance(arg_val, bool):
-                if arg_val:
-                    arg_val_print = "true"
-                else:
-                    arg_val_print = "false"
-            else:
-                arg_val_print = str(arg_val)
-            print_string = print_string + arg_val_print
+            print_string = print_string + self.to_print_string(arg_val)
             
         super().output(print_string)
         return None
 
+    #string form of value to be printed
+    def to_print_string(self, value):
+        #if value is of type bool, convert to corresponding strings
+        if isinstance(value, bool):
+            if value:
+                return "true"
+            else:
+                return "false"
+        return str(value)
+
     def do_inputi(self, args):
         #if length of arg > 1, throw error
         if len(args) > 1:
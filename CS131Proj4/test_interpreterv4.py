@@ -0,0 +1,135 @@
+"""
+Tests of the v4 interpreter's internals that the .br suites run by tester.py can't observe.
+
+Run from this directory with:  python3 -m unittest test_interpreterv4
+"""
+
+import unittest
+
+import interpreterv4
+from brewparse import parse_program
+from brewpasses import ConstantFolder
+from interpreterv4 import Interpreter
+
+
+def run_program(program, **kwargs):
+    interpreter = Interpreter(console_output=False, **kwargs)
+    interpreter.run(program)
+    return interpreter.get_output()
+
+
+class ConstantFolderTest(unittest.TestCase):
+    def folded_expression(self, expression):
+        ast = parse_program("func main() { x = %s; }" % expression)
+        ConstantFolder(Interpreter(console_output=False)).fold_program(ast)
+        return ast.get("functions")[0].get("statements")[0].get("expression")
+
+    def test_folds_literal_operators(self):
+        node = self.folded_expression('(2 + 3) * 4 == 20 && "a" + "b" == "ab"')
+        self.assertEqual((node.elem_type, node.get("val")), ("bool", True))
+
+    def test_leaves_string_repetition(self):
+        node = self.folded_expression('50000000 * "abcdefghij"')
+        self.assertEqual(node.elem_type, "*")
+
+    def test_leaves_errors_for_runtime(self):
+        for expression in ('1 / 0', '1 + "a"', '"a" - 1', '!"a"'):
+            self.assertNotIn(self.folded_expression(expression).elem_type,
+                             ConstantFolder.LITERALS, expression)
+
+    def test_leaves_input_prompts(self):
+        for builtin in ("inputi", "inputs"):
+            node = self.folded_expression('%s("x" + "y")' % builtin)
+            self.assertEqual(node.get("args")[0].elem_type, "+", builtin)
+
+    def test_input_prompt_output_unchanged(self):
+        program = 'func main() { x = inputi("x" + "y"); print(x); }'
+        for engine in ("tree", "bytecode", "closure"):
+            output = run_program(program, engine=engine, inp=["5"])
+            self.assertEqual(output, [None, "5"], engine)
+
+
+class BytecodeCallDepthTest(unittest.TestCase):
+    # 'return 1 + f(n - 1)' isn't a tail call, so every level keeps its frame
+    PROGRAM = """
+    func f(n) {
+      if (n == 0) {
+        return 0;
+      }
+      return 1 + f(n - 1);
+    }
+
+    func main() {
+      print(f(%d));
+    }
+    """
+
+    def test_deep_recursion_runs_past_python_recursion_limit(self):
+        self.assertEqual(run_program(self.PROGRAM % 50000, engine="bytecode"), ["50000"])
+
+    def test_recursion_within_max_call_depth(self):
+        self.assertEqual(run_program(self.PROGRAM % 90, engine="bytecode", max_call_depth=100),
+                         ["90"])
+
+    def test_recursion_past_max_call_depth_raises(self):
+        with self.assertRaises(RecursionError):
+            run_program(self.PROGRAM % 200, engine="bytecode", max_call_depth=100)
+
+
+class LazyCopyTest(unittest.TestCase):
+    # peek gets a by-value copy of a 300 object list and only reads its head, so each copy
+    # should die unread past the head instead of being fully copied by the next field write
+    PROGRAM = """
+    func build(n) {
+      head = nil;
+      i = 0;
+      while (i < n) {
+        node = @;
+        node.next = head;
+        node.v = i;
+        head = node;
+        i = i + 1;
+      }
+      return head;
+    }
+
+    func peek(o) {
+      return o.v;
+    }
+
+    func main() {
+      l = build(300);
+      s = @;
+      s.total = 0;
+      i = 0;
+      while (i < 50) {
+        s.total = s.total + peek(l);
+        i = i + 1;
+      }
+      print(s.total);
+    }
+    """
+
+    def test_dead_copies_are_dropped_before_next_field_write(self):
+        finish_copy = interpreterv4.Object.finish_copy
+        finished = [0]
+
+        # only counts, since holding on to the copies would keep them alive
+        def counting_finish_copy(obj):
+            if obj.source is not None:
+                finished[0] += 1
+            finish_copy(obj)
+
+        interpreterv4.Object.finish_copy = counting_finish_copy
+        try:
+            for engine in ("tree", "bytecode", "closure"):
+                finished[0] = 0
+                self.assertEqual(run_program(self.PROGRAM, engine=engine), ["14950"])
+                # the returned list once, then one copy per call to peek, not one per list node
+                self.assertLess(finished[0], 400, engine)
+        finally:
+            interpreterv4.Object.finish_copy = finish_copy
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,8 +20,10 @@ from harness import (
 class TestScaffold(AbstractTestScaffold):
     """Implement scaffold for Brewin' interpreter; load file, validate syntax, run testcase."""
 
-    def __init__(self, interpreter_lib):
+    def __init__(self, interpreter_lib, engine="tree", short_circuit=False):
         self.interpreter_lib = interpreter_lib
+        self.engine = engine
+        self.short_circuit = short_circuit
 
     def setup(self, test_case):
         srcfile = itemgetter("srcfile")(
@@ -47,7 +49,12 @@ class TestScaffold(AbstractTestScaffold):
         stdin, expected, program = itemgetter("stdin", "expected", "program")(
             environment
         )
-        interpreter = self.interpreter_lib.Interpreter(False, stdin, False)
+        if self.engine == "tree" and not self.short_circuit:
+            interpreter = self.interpreter_lib.Interpreter(False, stdin, False)
+        else:
+            interpreter = self.interpreter_lib.Interpreter(
+                False, stdin, False, engine=self.engine, short_circuit=self.short_circuit
+            )
         try:
             interpreter.run(program)
         except Exception as exception:  # pylint: disable=broad-except
@@ -161,25 +168,38 @@ def generate_test_suite_v3():
         fails,
     )
 
-def generate_test_suite_v4():
-    """wrapper for generate_test_suite for v4"""
+def generate_test_suite_v4(short_circuit=False):
+    """wrapper for generate_test_suite for v4; short_circuit adds the tests of that mode"""
     tests = __get_file_names(getcwd() + "/v4/tests/")
     fails = __get_file_names(getcwd() + "/v4/fails/")
-    return __generate_test_suite(
+    suite = __generate_test_suite(
         4,
         tests,
         fails,
     )
+    if short_circuit:
+        suite += __generate_test_case_structure(
+            __get_file_names(getcwd() + "/v4/short_circuit/"),
+            "v4/short_circuit/",
+            "Short circuit",
+        )
+    return suite
 
 async def main():
     """main entrypoint: argparses, delegates to test scaffold, suite generator, gradescope output"""
     if not sys.argv:
         raise ValueError("Error: Missing version number argument")
     version = sys.argv[1]
+    # --short-circuit (v4) runs with Interpreter(short_circuit=True)
+    options = [arg for arg in sys.argv[2:] if arg.startswith("--")]
+    arguments = [arg for arg in sys.argv[2:] if not arg.startswith("--")]
+    short_circuit = "--short-circuit" in options
+    # optional second argument picks the execution engine, e.g. "bytecode"
+    engine = arguments[0] if arguments else "tree"
     module_name = f"interpreterv{version}"
     interpreter = importlib.import_module(module_name)
 
-    scaffold = TestScaffold(interpreter)
+    scaffold = TestScaffold(interpreter, engine, short_circuit)
 
     match version:
         case "1":
@@ -189,7 +209,7 @@ async def main():
         case "3":
             tests = generate_test_suite_v3()
         case "4":
-            tests = generate_test_suite_v4()    
+            tests = generate_test_suite_v4(short_circuit)
         case _:
             raise ValueError("Unsupported version; expect one of {1, 2, 3, 4}")
 